@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Benchmarks the strings and stringsdict processing of iosTransifex.py against synthetic resources.
+# Results can be saved as JSON and compared against the results of another revision.
+
+import json, os, sys, time, argparse, random, subprocess, tracemalloc, tempfile, hashlib, shutil, ast, types, importlib, contextlib, io
+
+SCRIPT_FOLDER = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, SCRIPT_FOLDER)
+tx = None
+
+DEFAULT_SIZES = [5000, 50000, 500000]
+EXPORT_LANGUAGES = 19
+SEED = 35
+WORDS = ["file", "folder", "upload", "download", "account", "contact", "chat", "meeting", "link", "transfer", "storage", "photo", "video",
+         "camera", "backup", "device", "password", "recovery", "key", "settings", "share", "sync", "offline", "album", "message", "call"]
+COMMENTS = ["", "Button title to cancel something", "Alert message shown when the user's storage is full", "Title of the \"Shared items\" section",
+            "Error message shown when the link can't be opened", "Label for the number of selected files"]
+UPLOAD_FRAGMENTS = ["Please try again...", "Don't", "%@", "%1$d", "[A]Learn more[/A]", "[B]", "[/B]", "\\n", "\\\"quoted\\\"", "'single'",
+                    "<b>", "</b>", "The user's", "'93", "[X]", "[/X]"]
+DOWNLOAD_FRAGMENTS = ["Please try again...", "Don’t", "%@", "%1$d", "[a]Learn more[/a]", "[b]", "[/b]", "[Br]", "“quoted”", "‘single’",
+                      "<b>", "</b>", "The user’s", "[x1]", "[/x1]", "[a2]", "[/a2]"]
+PLURAL_KEYS = ["one", "other", "few", "many"]
+
+# Call this function to return a random sentence built from words and the fragments of the given direction
+def make_sentence(rng, upload):
+    fragments = UPLOAD_FRAGMENTS if upload else DOWNLOAD_FRAGMENTS
+    parts = []
+    for i in range(rng.randint(2, 12)):
+        if rng.random() < 0.25:
+            parts.append(rng.choice(fragments))
+        else:
+            parts.append(rng.choice(WORDS))
+    return " ".join(parts).capitalize()
+
+# Call this function to return a synthetic strings file with the given number of keys. About 1 in 10 strings repeat an earlier one
+def make_strings(size, upload, seed = SEED):
+    rng = random.Random(seed)
+    lines = []
+    values = []
+    for i in range(size):
+        if values and rng.random() < 0.1:
+            value = rng.choice(values)
+        else:
+            value = make_sentence(rng, upload)
+            values.append(value)
+        lines.append("/* " + rng.choice(COMMENTS) + " */")
+        lines.append("\"" + rng.choice(WORDS) + "." + str(i) + "\"=\"" + value + "\";")
+    return "\n".join(lines)
+
+# Call this function to return a synthetic stringsdict file with the given number of keys
+def make_stringsdict(size, upload, seed = SEED):
+    rng = random.Random(seed)
+    map = {}
+    for i in range(size):
+        strings = {}
+        for plural_key in PLURAL_KEYS[0:rng.randint(2, 4)]:
+            strings[plural_key] = "%d " + make_sentence(rng, upload).replace("\\\"", "&quot;").replace("<", "&lt;").replace(">", "&gt;")
+        map[rng.choice(WORDS) + ".plural." + str(i)] = {"var": "%#@count@", "ctx": "count", "str": strings}
+    return tx.map_to_content(map, True)
+
+# Call this function to time the given function, returning the best time of the given number of runs and the result of the last run
+def time_call(function, repeat):
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    return best, result
+
+# Call this function to return the peak memory in bytes allocated while running the given function
+def peak_memory(function):
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+# Call this function to measure a single function call and return its result row
+def measure(name, direction, file_type, keys, size_bytes, function, repeat, memory):
+    seconds, result = time_call(function, repeat)
+    row = {
+        "function": name,
+        "direction": direction,
+        "type": file_type,
+        "keys": keys,
+        "bytes": size_bytes,
+        "seconds": round(seconds, 6),
+        "keys_per_second": round(keys / seconds) if seconds > 0 else 0,
+        "mb_per_second": round(size_bytes / seconds / 1048576, 3) if seconds > 0 else 0,
+        "peak_mb": round(peak_memory(function) / 1048576, 3) if memory else None
+    }
+    print_row(row)
+    return row, result
+
+# Call this function to print a result row
+def print_row(row):
+    data = row["function"].ljust(20) + row["direction"].ljust(10) + row["type"].ljust(13) + str(row["keys"]).rjust(8) + " keys " + ("%.3f" % row["seconds"]).rjust(9) + "s " + str(row["keys_per_second"]).rjust(10) + " keys/s " + ("%.2f" % row["mb_per_second"]).rjust(8) + " MB/s"
+    if row["peak_mb"] != None:
+        data = data + ("%.1f" % row["peak_mb"]).rjust(9) + " MB peak"
+    print(data)
+
+# Call this function to benchmark every function for the given number of keys
+def run_size(size, repeat, memory):
+    rows = []
+    for upload in [True, False]:
+        direction = "upload" if upload else "download"
+        for is_plurals in [False, True]:
+            file_type = "stringsdict" if is_plurals else "strings"
+            if is_plurals:
+                content = make_stringsdict(size, upload)
+            else:
+                content = make_strings(size, upload)
+            size_bytes = len(content.encode("utf-8"))
+            row, map = measure("content_to_map", direction, file_type, size, size_bytes, lambda: tx.content_to_map(content, upload, is_plurals), repeat, memory)
+            rows.append(row)
+            row, output = measure("map_to_content", direction, file_type, size, size_bytes, lambda: tx.map_to_content(map, is_plurals), repeat, memory)
+            rows.append(row)
+            # The branch changes a tenth of the strings and adds as many new ones
+            branch_size = max(1, size // 10)
+            if is_plurals:
+                branch = make_stringsdict(branch_size, upload, SEED + 1)
+            else:
+                branch = make_strings(branch_size, upload, SEED + 1)
+            row, merged = measure("merge_strings", direction, file_type, size, size_bytes, lambda: tx.merge_strings(content, branch, upload, is_plurals), repeat, memory)
+            rows.append(row)
+            if upload:
+                row, valid = measure("validate_file", direction, file_type, size, size_bytes, lambda: tx.validate_file(content, is_plurals), repeat, memory)
+                rows.append(row)
+            if is_plurals:
+                lines = [line.strip() for line in output.split("\n")]
+                row, indented = measure("indent_xml", direction, file_type, size, size_bytes, lambda: tx.indent_xml(lines), repeat, memory)
+                rows.append(row)
+            else:
+                strings = [map[key]["s"] for key in map]
+                strings_bytes = sum(len(string.encode("utf-8")) for string in strings)
+                row, replaced = measure("replace_characters", direction, file_type, size, strings_bytes, lambda: [tx.replace_characters(string, upload) for string in strings], repeat, memory)
+                rows.append(row)
+    return rows
+
+# Call this function to time converting generated language files into the English mapping of their resource and writing them, as the
+# export does, with each of the given numbers of conversion processes. The time includes starting the processes
+def run_conversion(size, processes):
+    english = tx.content_to_map(make_strings(size, False), False)
+    folder = tempfile.mkdtemp()
+    rows = []
+    try:
+        jobs = []
+        for i in range(EXPORT_LANGUAGES):
+            content = make_strings(size, False, SEED + 2 + i)
+            download_path = os.path.join(folder, "download-" + str(i))
+            with open(download_path, "w", encoding="utf-8") as file:
+                file.write(content)
+            jobs.append((download_path, hashlib.sha256(content.encode("utf-8")).hexdigest(), os.path.join(folder, "output-" + str(i))))
+        size_bytes = sum(os.path.getsize(job[0]) for job in jobs)
+        base = None
+        for count in processes:
+            tx.set_cpu_workers(count)
+            def convert():
+                pool = tx.start_conversion_pool({"Localizable": english})
+                if pool == None:
+                    tx.init_conversion_process({"Localizable": english}, False, 0)
+                    for job in jobs:
+                        tx.convert_language_file("Localizable", job[0], job[1], False, job[2])
+                    return
+                with pool:
+                    futures = [pool.submit(tx.convert_language_file, "Localizable", job[0], job[1], False, job[2]) for job in jobs]
+                    for future in futures:
+                        future.result()
+            row, result = measure("export_convert/" + str(count), "download", "strings", size * EXPORT_LANGUAGES, size_bytes, convert, 1, False)
+            rows.append(row)
+            if base == None:
+                base = row["seconds"]
+            elif row["seconds"] > 0:
+                print("Speedup with " + str(count) + " processes: " + ("%.2fx" % (base / row["seconds"])))
+    finally:
+        shutil.rmtree(folder)
+    return rows
+
+# Call this function to print the change of each result against the matching result of a previous run
+def compare_results(rows, path):
+    try:
+        with open(path, "r") as file:
+            baseline = json.load(file)
+    except (OSError, ValueError) as ex:
+        print("Error: Cannot read results to compare against: " + str(ex))
+        return
+    previous = {}
+    for row in baseline["results"]:
+        previous[(row["function"], row["direction"], row["type"], row["keys"])] = row
+    print("Compared to " + str(baseline.get("revision")) + " (time ratio, below 1 is faster):")
+    for row in rows:
+        old = previous.get((row["function"], row["direction"], row["type"], row["keys"]))
+        if old == None or old["seconds"] == 0:
+            continue
+        data = row["function"].ljust(20) + row["direction"].ljust(10) + row["type"].ljust(13) + str(row["keys"]).rjust(8) + " keys " + ("%.2fx" % (row["seconds"] / old["seconds"])).rjust(8)
+        if row["peak_mb"] != None and old.get("peak_mb"):
+            data = data + " memory " + ("%.2fx" % (row["peak_mb"] / old["peak_mb"])).rjust(7)
+        print(data)
+
+# Call this function to return the short hash of the given git revision, by default of the checkout, or None
+def get_revision(revision = "HEAD"):
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", revision], cwd=SCRIPT_FOLDER, universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# Call this function to load iosTransifex.py as it was in the given git revision. Only its imports, functions, classes and constants are
+# run, so older revisions that read the configuration, check the tokens and run main when imported can be loaded too. Constants that
+# can't be set up outside of a checkout, such as the resources read from the configuration, are left out with their output
+def load_revision(revision):
+    path = os.path.join(SCRIPT_FOLDER, "iosTransifex.py")
+    source = subprocess.check_output(["git", "show", revision + ":./iosTransifex.py"], cwd=SCRIPT_FOLDER)
+    tree = ast.parse(source, path)
+    # Older revisions build the request headers from the tokens when imported. The benchmark makes no requests
+    os.environ.setdefault("TRANSIFEX_TOKEN", "")
+    os.environ.setdefault("GITLAB_TOKEN", "")
+    module = types.ModuleType("iosTransifex")
+    module.__file__ = path
+    for node in tree.body:
+        if not is_definition(node):
+            continue
+        code = compile(ast.Module(body=[node], type_ignores=[]), path, "exec")
+        if not isinstance(node, ast.Assign):
+            exec(code, module.__dict__)
+            continue
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                exec(code, module.__dict__)
+        except (Exception, SystemExit):
+            pass
+    return module
+
+# Call this function to check if a top level statement of the script only defines something. Conditions are kept when they choose
+# the imports of the Python version, any other statement is skipped
+def is_definition(node):
+    if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef, ast.Assign)):
+        return True
+    if isinstance(node, ast.If):
+        return any(isinstance(child, (ast.Import, ast.ImportFrom)) for child in ast.walk(node))
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the strings processing of iosTransifex.py")
+    parser.add_argument("-s", "--sizes", nargs="+", help="The numbers of keys of the generated resources. Defaults to " + " ".join(str(size) for size in DEFAULT_SIZES), type=int, default=DEFAULT_SIZES)
+    parser.add_argument("-n", "--repeat", nargs=1, help="The number of times each function is timed, the best time is reported. Defaults to 3", type=int)
+    parser.add_argument("-o", "--output", nargs=1, help="The file to save the results to as JSON")
+    parser.add_argument("-c", "--compare", nargs=1, help="A JSON results file of a previous run to compare against")
+    parser.add_argument("-p", "--processes", nargs="+", help="Also time the export conversion of " + str(EXPORT_LANGUAGES) + " languages with each of the given numbers of processes, e.g: 1 2 4 8", type=int)
+    parser.add_argument("-r", "--revision", nargs=1, help="The git revision of iosTransifex.py to benchmark instead of the working tree, e.g: HEAD~1")
+    parser.add_argument("--noMemory", help="Skip measuring the peak memory of each function", action="store_true")
+    args = parser.parse_args()
+
+    global tx
+    if args.revision:
+        try:
+            tx = load_revision(args.revision[0])
+        except (OSError, subprocess.CalledProcessError, SyntaxError) as ex:
+            print("Error: Cannot load iosTransifex.py from revision " + args.revision[0] + ": " + str(ex))
+            sys.exit(1)
+        if args.processes:
+            # The conversion processes import the script of the working tree
+            print("WARN: The export conversion is only timed for the working tree, ignoring -p")
+            args.processes = None
+    else:
+        tx = importlib.import_module("iosTransifex")
+
+    # Every run has to parse, not load the parsed mapping from the cache
+    tx.map_cache_enabled = False
+    repeat = args.repeat[0] if args.repeat else 3
+    rows = []
+    for size in args.sizes:
+        print("Benchmarking " + str(size) + " keys")
+        rows = rows + run_size(size, repeat, not args.noMemory)
+        if args.processes:
+            rows = rows + run_conversion(size, args.processes)
+    if args.output:
+        results = {
+            "revision": get_revision(args.revision[0] if args.revision else "HEAD"),
+            "python": sys.version.split(" ")[0],
+            "cpus": os.cpu_count(),
+            "repeat": repeat,
+            "results": rows
+        }
+        with open(args.output[0], "w") as file:
+            json.dump(results, file, indent=2)
+        print("Results saved to " + args.output[0])
+    if args.compare:
+        compare_results(rows, args.compare[0])
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -1,19 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json, os, sys, re, subprocess, time, argparse, datetime
-from pyexpat import ExpatError
-from xml.dom.minidom import parseString
-from threading import Thread
+import json, os, sys, re, subprocess, atexit, time, argparse, datetime, hashlib, io, math, random, gzip, filecmp, shutil, codecs
+from pyexpat import ExpatError, ParserCreate
+from threading import Lock, Condition, get_ident
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from types import MappingProxyType
 
 version = sys.version_info.major
 if version == 2:
-    from urllib2 import Request, urlopen, install_opener, build_opener, HTTPRedirectHandler, HTTPError
+    from urllib2 import HTTPError
     reload(sys)
     sys.setdefaultencoding('utf8')
 else:
-    from urllib.request import Request, urlopen, install_opener, build_opener, HTTPRedirectHandler
     from urllib.error import HTTPError
+    from urllib.parse import urlsplit
+    import http.client
 
 transifex_token = os.getenv("TRANSIFEX_TOKEN")
 gitlab_token = os.getenv("GITLAB_TOKEN")
@@ -24,47 +28,22 @@ git_id = 193
 git_branch = "develop"
 prod_path = "Modules/Presentation/MEGAL10n/Sources/MEGAL10n/Resources/"
 is_lib = False
+map_cache_size = 64
+local_git_enabled = False
+cpu_workers = 1
+BASE_URL = os.getenv("TRANSIFEX_BASE_URL") or "https://rest.api.transifex.com"
+GITLAB_BASE_URL = os.getenv("GITLAB_BASE_URL") or "https://code.developers.mega.co.nz/api/v4"
 
-config_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'transifexConfig.json')
-if os.path.exists(config_file):
-    transifex_config_file = open(config_file, "r")
-    content = transifex_config_file.read()
-    transifex_config_file.close()
-    transifex_config = json.loads(content)
-
-    transifex_token = transifex_config.get('apiToken') or transifex_token
-    gitlab_token = transifex_config.get('gitLabToken') or gitlab_token
-    transifex_bot_token = transifex_config.get('botToken') or transifex_bot_token
-    transifex_bot_url = transifex_config.get('botUrl') or transifex_bot_url
-    transifex_project_name = transifex_config.get('projectName') or transifex_project_name
-    git_id = transifex_config.get('gitId') or git_id
-    git_branch = transifex_config.get('gitDefaultBranch') or git_branch
-    prod_path = transifex_config.get('langStorePath') or prod_path
-    is_lib = transifex_config.get('lib') or is_lib
-
-if not transifex_token:
-    print("Error: Missing transifex token.")
-    sys.exit(1)
-
-if not gitlab_token:
-    print("Error: Missing gitlab token.")
-    sys.exit(1)
-
-BASE_URL = "https://rest.api.transifex.com"
-GITLAB_URL = "https://code.developers.mega.co.nz/api/v4/projects/" + str(git_id) + "/repository/files/$pathBase.lproj%2F$file/raw?ref=" + git_branch
-PROJECT_ID = "o:meganz-1:p:" + transifex_project_name
 STORES_IOS_ID = "o:meganz-1:p:stores:r:app_store_ios"
 STORES_IOS_VPN_ID = "o:meganz-1:p:mega-vpn-ios:r:app_store_ios_vpn"
 STORES_IOS_PWD_ID = "o:meganz-1:p:password-manager-ios:r:"
-HEADER = {
-    "Authorization": "Bearer " + transifex_token,
-    "Content-Type": "application/vnd.api+json"
-}
 REMAPPED_CODE = {
     "zh_CN": "zh-Hans",
     "zh_TW": "zh-Hant",
 }
 I18N_FORMAT = ["STRINGS", "STRINGSDICT"]
+BULK_CONTENT_TYPE = "application/vnd.api+json;profile=\"bulk\""
+BULK_SIZE = 150
 
 # Wrapper to read content from file
 def file_get_contents(filepath):
@@ -73,6 +52,26 @@ def file_get_contents(filepath):
     return content
 
 DOWNLOAD_FOLDER = os.getcwd() + "/download/"
+MAP_CACHE_FOLDER = DOWNLOAD_FOLDER + ".map_cache/"
+MAP_CACHE_VERSION = "2"
+STRINGSDICT_CHUNK_SIZE = 65536
+STREAM_CHUNK_SIZE = 65536
+RATE_LIMIT_RETRIES = 5
+RATE_LIMIT_MAX_DELAY = 60
+REQUEST_TIMEOUT = 120
+CONNECTION_POOL_SIZE = 16
+HTTP_CACHE_FOLDER = DOWNLOAD_FOLDER + ".http_cache/"
+EXPORT_MANIFEST_FILE = DOWNLOAD_FOLDER + ".export_manifest.json"
+POLL_HISTORY_FILE = DOWNLOAD_FOLDER + ".poll_history.json"
+POLL_HISTORY_SIZE = 20
+POLL_FIRST_DELAY = 0.5
+POLL_MAX_DELAY = 10
+POLL_BACKOFF = 1.6
+POLL_TIMEOUT = 100
+PRUNE_MAX_DELAY = 30
+PRUNE_TIMEOUT = 300
+USER_AGENT = "Python-urllib/" + str(sys.version_info.major) + "." + str(sys.version_info.minor)
+PLIST_HEADER = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n<!DOCTYPE plist PUBLIC \"-//Apple//DTD PLIST 1.0//EN\" \"http://www.apple.com/DTDs/PropertyList-1.0.dtd\">\n<plist version=\"1.0\">\n  <dict>"
 git_path = os.getcwd()
 
 # Read in the config file to determine the RESERVED_RESOURCES values.
@@ -99,29 +98,155 @@ def parse_strings_config(path):
         sys.exit(1)
     return map
 
-config_file = transifex_project_name + "-resources.conf"
-if is_lib:
-    config_file = "lib-resources.conf"
-config_map = parse_strings_config(os.path.join(os.path.dirname(os.path.realpath(__file__)), config_file))
-RESERVED_RESOURCES = config_map.keys()
+config_loaded = False
+config_map = {}
+RESERVED_RESOURCES = []
+GITLAB_URL = ""
+PROJECT_ID = ""
+PROD_FOLDER = ""
+HEADER = {}
+
+# Call this function to read the configuration, check the tokens and create the output folders. Nothing is read until the first call
+def load_config():
+    global config_loaded, transifex_token, gitlab_token, transifex_bot_token, transifex_bot_url, transifex_project_name, git_id, git_branch, prod_path, is_lib, map_cache_size, map_cache_enabled, local_git_enabled, cpu_workers
+    global BASE_URL, GITLAB_BASE_URL, GITLAB_URL, PROJECT_ID, HEADER, config_map, RESERVED_RESOURCES, git_path, PROD_FOLDER
+    if config_loaded:
+        return
+    config_loaded = True
+    config_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'transifexConfig.json')
+    if os.path.exists(config_file):
+        transifex_config_file = open(config_file, "r")
+        content = transifex_config_file.read()
+        transifex_config_file.close()
+        transifex_config = json.loads(content)
+
+        transifex_token = transifex_config.get('apiToken') or transifex_token
+        gitlab_token = transifex_config.get('gitLabToken') or gitlab_token
+        transifex_bot_token = transifex_config.get('botToken') or transifex_bot_token
+        transifex_bot_url = transifex_config.get('botUrl') or transifex_bot_url
+        transifex_project_name = transifex_config.get('projectName') or transifex_project_name
+        git_id = transifex_config.get('gitId') or git_id
+        git_branch = transifex_config.get('gitDefaultBranch') or git_branch
+        prod_path = transifex_config.get('langStorePath') or prod_path
+        is_lib = transifex_config.get('lib') or is_lib
+        if 'mapCacheSize' in transifex_config:
+            map_cache_size = transifex_config['mapCacheSize']
+            map_cache_enabled = map_cache_size > 0
+        local_git_enabled = transifex_config.get('localGit') or local_git_enabled
+        cpu_workers = transifex_config.get('cpuWorkers') or cpu_workers
+        BASE_URL = transifex_config.get('baseUrl') or BASE_URL
+        GITLAB_BASE_URL = transifex_config.get('gitLabUrl') or GITLAB_BASE_URL
+
+    if not transifex_token:
+        print("Error: Missing transifex token.")
+        sys.exit(1)
+
+    if not gitlab_token:
+        print("Error: Missing gitlab token.")
+        sys.exit(1)
+
+    GITLAB_URL = GITLAB_BASE_URL + "/projects/" + str(git_id) + "/repository/files/$pathBase.lproj%2F$file/raw?ref=" + git_branch
+    PROJECT_ID = "o:meganz-1:p:" + transifex_project_name
+    HEADER = {
+        "Authorization": "Bearer " + transifex_token,
+        "Content-Type": "application/vnd.api+json"
+    }
+
+    config_file = transifex_project_name + "-resources.conf"
+    if is_lib:
+        config_file = "lib-resources.conf"
+    config_map = parse_strings_config(os.path.join(os.path.dirname(os.path.realpath(__file__)), config_file))
+    RESERVED_RESOURCES = config_map.keys()
 
-if "/transifex" in git_path:
-    git_path = git_path + "/.."
-PROD_FOLDER = git_path + "/" + prod_path
-if not os.path.isdir(PROD_FOLDER):
-    os.makedirs(PROD_FOLDER)
-if not os.path.isdir(DOWNLOAD_FOLDER):
-    os.makedirs(DOWNLOAD_FOLDER)
+    if "/transifex" in git_path:
+        git_path = git_path + "/.."
+    PROD_FOLDER = git_path + "/" + prod_path
+    if not os.path.isdir(PROD_FOLDER):
+        os.makedirs(PROD_FOLDER)
+    if not os.path.isdir(DOWNLOAD_FOLDER):
+        os.makedirs(DOWNLOAD_FOLDER)
 
 resources = {}
+resource_index = {}
+resource_lookups = {}
+resource_lock = Lock()
 language_cache = {}
+branch_name_cache = None
 base_strings = []
 branch_strings = {}
 user_cache = {}
 # re.sub compatible version of PHP regex: /^[\pZ\pC]+|[\pZ\pC]+$/u as \p is not supported
-unicode_regex = re.compile('^[\u0000-\u0020\u007F-\u00A0\u00AD\u0600-\u0605\u061C\u06DD\u070F\u08E2\u1680\u180E\u2000-\u200F\u2028-\u202F\u205F-\u2064\u2066-\u206F\u3000\uFEFF\uFFF9-\uFFFB\U000110BD\U000110CD\U00013430-\U00013438\U0001BCA0\U0001BCA3\U0001D173-\U0001D17A\U000E0001\U000E0020-\U000E007F]+|[\u0000-\u0020\u007F-\u00A0\u00AD\u0600-\u0605\u061C\u06DD\u070F\u08E2\u1680\u180E\u2000-\u200F\u2028-\u202F\u205F-\u2064\u2066-\u206F\u3000\uFEFF\uFFF9-\uFFFB\U000110BD\U000110CD\U00013430-\U00013438\U0001BCA0\U0001BCA3\U0001D173-\U0001D17A\U000E0001\U000E0020-\U000E007F]+$', re.UNICODE)
+unicode_class = '[\u0000-\u0020\u007F-\u00A0\u00AD\u0600-\u0605\u061C\u06DD\u070F\u08E2\u1680\u180E\u2000-\u200F\u2028-\u202F\u205F-\u2064\u2066-\u206F\u3000\uFEFF\uFFF9-\uFFFB\U000110BD\U000110CD\U00013430-\U00013438\U0001BCA0\U0001BCA3\U0001D173-\U0001D17A\U000E0001\U000E0020-\U000E007F]'
+unicode_regex = re.compile('^' + unicode_class + '+|' + unicode_class + '+$', re.UNICODE)
+unicode_leading_regex = re.compile('^' + unicode_class + '+', re.UNICODE)
+unicode_trailing_regex = re.compile(unicode_class + '+$', re.UNICODE)
+unicode_only_regex = re.compile(unicode_class + '*', re.UNICODE)
 xml_tag_regex = re.compile(r'<[^[sd][^>]*>')
+INDENT_CLOSED_REGEX = re.compile(r'.+<\/\w[^>]*>$')
+INDENT_CLOSE_REGEX = re.compile(r'^<\/\w')
+INDENT_OPEN_REGEX = re.compile(r'^<\w[^>]*[^\/]>.*$')
+UNESCAPED_QUOTE_REGEX = re.compile('(?<!\\\\)(?:\\\\{2})*"')
+# Quote and punctuation replacements for uploads as (pattern, replacement, character the pattern requires), applied in order
+UPLOAD_REPLACEMENTS = [
+    (re.compile(r"'''"), r'‴', "'"),                                                             # A. Triple prime
+    (re.compile(r'(\W|^)"(\w)'), r'\1“\2', '"'),                                                 # B. Beginning double quote
+    (re.compile(r'(“[^"]*)"([^"]*$|[^“"]*“)'), r'\1”\2', '"'),                                   # C. Ending double quote
+    (re.compile(r'([^0-9])"'), r'\1”', '"'),                                                     # D. Remaining double quote at the end of word
+    (re.compile(r"''"), r'″', "'"),                                                              # E. Double prime as two single quotes
+    (re.compile(r"(\W|^)'(\S)"), r"\1‘\2", "'"),                                                 # F. Beginning single quote
+    (re.compile(r"([A-z0-9])'([A-z])"), r"\1’\2", "'"),                                          # G. Conjunction's possession
+    (re.compile(r"(‘)([0-9]{2}[^’]*)(‘([^0-9]|$)|$|’[A-z])"), r"’\2\3", "‘"),                    # H. Abbreviated years like '93
+    (re.compile(r"((‘[^']*)|[A-z])'([^0-9]|$)"), r"\1’\3", "'"),                                 # I. Ending single quote
+    (re.compile(r"(\B|^)‘(?=([^‘’]*’\b)*([^‘’]*\B\W[‘’]\b|[^‘’]*$))"), r"\1’", "‘"),             # J. Backwards apostrophe
+    (re.compile(r'"'), r"″", '"'),                                                               # K. Double prime
+    (re.compile(r"'"), r"′", "'"),                                                               # L. Prime
+    (re.compile(r"\.\.\."), r"…", "...")                                                         # M. Ellipsis
+]
+ELLIPSIS_REGEX = UPLOAD_REPLACEMENTS[12][0]
+# Lower case placeholder tags from Transifex and their upper case versions used in the app
+DOWNLOAD_TAGS = {
+    "[x]": "[X]",
+    "[a]": "[A]",
+    "[/a]": "[/A]",
+    "[b]": "[B]",
+    "[/b]": "[/B]",
+    "[a1]": "[A1]",
+    "[/a1]": "[/A2]",
+    "[a2]": "[A2]",
+    "[/a2]": "[/A2]",
+    "[x1]": "[X1]",
+    "[/x1]": "[/X1]",
+    "[x2]": "[X2]",
+    "[/x2]": "[/X2]"
+}
+DOWNLOAD_TAG_REGEX = re.compile("|".join(re.escape(tag) for tag in DOWNLOAD_TAGS))
 jira_id = ""
+export_workers = 8
+rate_limit = {"limit": export_workers, "max": export_workers, "active": 0, "successes": 0, "throttled": 0}
+rate_limit_condition = Condition()
+poll_history = None
+poll_history_lock = Lock()
+connection_pools = {}
+connection_pool_lock = Lock()
+connection_stats = {"requests": 0, "opened": 0, "reused": 0, "stale": 0}
+map_cache_enabled = map_cache_size > 0
+map_cache_lock = Lock()
+map_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+store_lock = Lock()
+store_stats = {"written": 0, "skipped": 0}
+http_cache_enabled = True
+http_cache_ttl = 0
+http_cache_lock = Lock()
+http_cache_stats = {"fresh": 0, "not_modified": 0, "fetched": 0, "offline": 0}
+# Upper bounds in seconds of the request latency histogram buckets, slower requests are counted in a last bucket
+HTTP_STATS_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+http_stats = {}
+http_stats_lock = Lock()
+poll_stats = {}
+git_objects = {"process": None, "commit": None, "failed": False}
+git_objects_lock = Lock()
+git_objects_stats = {"read": 0, "missing": 0, "api": 0}
+export_english = {} # English mappings of the exported resources by name, in a conversion process
 
 # Call this function to create a new resource in Transifex for the current git branch and create a local file for string additions/edits
 # Or call this function to create a new feature resource in Transifex with the given resource name
@@ -180,20 +305,23 @@ def run_download(resource, folder = DOWNLOAD_FOLDER):
     if does_resource_exist(resource):
         print("Downloading " + resource)
         is_plurals = "Plurals" in resource
-        content = resource_get_english(resource, is_plurals)
-        if content:
-            if folder == PROD_FOLDER:
-                store_file(resource, process_as_download(content, is_plurals))
+        if folder == PROD_FOLDER:
+            content = resource_get_english(resource, is_plurals)
+            if content:
+                store_map(resource, content_to_map(content, False, is_plurals), is_plurals)
             else:
-                file_path = folder + "/" + get_file_basename(resource)
-                file_put_contents(file_path, content)
-                print("File saved to " + file_path)
+                print("Error: Failed to download resource " + resource)
         else:
-            print("Error: Failed to download resource " + resource)
+            file_path = folder + "/" + get_file_basename(resource)
+            if resource_get_english(resource, is_plurals, file_path):
+                print("File saved to " + file_path)
+            else:
+                print("Error: Failed to download resource " + resource)
     else:
         print("Error: Resource " + resource + " not found")
 
 # Call this function to download each reserved resource to the Production folder
+# With return_values set, returns the read only parsed English mapping and the content hash of each resource by resource id
 def run_fetch(merge = False, return_values = False):
     resources = get_resources()
     branch = get_branch_name()
@@ -211,9 +339,10 @@ def run_fetch(merge = False, return_values = False):
                 is_plurals = "Plurals" in resource_name
                 content = resource_get_english(resource_name, is_plurals)
                 if content:
-                    store_file(resource_name, process_as_download(content, is_plurals))
+                    map = content_to_map(content, False, is_plurals)
+                    store_map(resource_name, map, is_plurals)
                     if return_values:
-                        return_map[resource] = content
+                        return_map[resource] = {"map": MappingProxyType(map), "hash": hashlib.sha256(content.encode("utf-8")).hexdigest()}
                 else:
                     print("Error: Failed to download resource " + resource_name)
     if return_values:
@@ -221,7 +350,8 @@ def run_fetch(merge = False, return_values = False):
     return True
 
 # Call this function to download each reserved resource and each language to the Production folder
-def run_export(merge = False, spec_resource = False):
+# With incremental set, only the resource languages updated in Transifex since the previous incremental export are downloaded
+def run_export(merge = False, spec_resource = False, incremental = False):
     languages = get_languages()
     branch = ""
     if merge:
@@ -230,21 +360,54 @@ def run_export(merge = False, spec_resource = False):
         else:
             print("Error: Cannot export and merge for a branch on master/develop")
             merge = False
-    def export_resource_language(resource, language, en_file):
+    # en_map is the English mapping shared by every language of the resource, it is only read and never copied per language.
+    # With a conversion pool the language is only downloaded here and the pending conversion is returned for finish_conversion
+    def export_resource_language(resource, language, en_map):
         if merge and does_resource_exist(resource + "-" + branch):
-            run_merge(resource, resource + "-" + branch, language, languages[language]["code"])
-            return
+            return run_merge(resource, resource + "-" + branch, language, languages[language]["code"]) == True
         is_plurals = "Plurals" in resource
-        content = resource_get_language(resource, language, is_plurals)
-        if content:
-            code = languages[language]["code"]
-            if code in REMAPPED_CODE:
-                code = REMAPPED_CODE[code]
-            if en_file:
-                content = merge_strings(en_file, content, False, is_plurals, True)
-            store_file(resource, process_as_download(content, is_plurals), code)
+        code = languages[language]["code"]
+        if code in REMAPPED_CODE:
+            code = REMAPPED_CODE[code]
+        map = False
+        if converter != None:
+            download_path = temp_path(DOWNLOAD_FOLDER + "download-" + code + "-" + get_file_basename(resource))
+            digest = resource_get_language(resource, language, is_plurals, False, download_path)
+            if digest != False:
+                output_path = temp_path(get_store_path(resource, code))
+                try:
+                    future = converter.submit(convert_language_file, resource, download_path, digest, is_plurals, output_path)
+                    return {"future": future, "download": download_path, "output": output_path, "code": code}
+                except (BrokenProcessPool, RuntimeError):
+                    map = load_downloaded_map(download_path, digest, is_plurals)
+                    os.remove(download_path)
         else:
-            print("Error: Failed to download resource " + resource + " in language " + languages[language]["name"])
+            map = resource_get_language(resource, language, is_plurals, True)
+        if map != False:
+            if en_map:
+                map = merge_maps(en_map, map, is_plurals, True)
+            store_map(resource, map, is_plurals, code)
+            return True
+        print("Error: Failed to download resource " + resource + " in language " + languages[language]["name"])
+        return False
+
+    # Call this function to wait for the conversion of a resource language in the conversion pool and store the converted file
+    def finish_conversion(resource, language, pending):
+        try:
+            counts = pending["future"].result()
+            with map_cache_lock:
+                for key in counts:
+                    map_cache_stats[key] += counts[key]
+            store_written_file(resource, pending["output"], pending["code"])
+            return True
+        except Exception as ex:
+            print("Error: Failed to convert resource " + resource + " in language " + languages[language]["name"] + ": " + type(ex).__name__ + ": " + str(ex))
+            if os.path.exists(pending["output"]):
+                os.remove(pending["output"])
+            return False
+        finally:
+            if os.path.exists(pending["download"]):
+                os.remove(pending["download"])
 
     resources = get_resources()
     print("Exporting English")
@@ -259,31 +422,162 @@ def run_export(merge = False, spec_resource = False):
             return False
     else:
         en = run_fetch(merge, True)
-    threads = []
+    stats = False
+    manifest = {}
+    if incremental and not merge: # Full exports don't request the stats, so the manifest is only kept by incremental exports
+        stats = get_resource_language_stats()
+        manifest = load_export_manifest()
+    if incremental and stats == False:
+        print("WARN: Unable to check for updated resource languages. Exporting everything")
+    jobs = []
+    skipped = 0
     for resource in resources:
         if resources[resource]["name"] in RESERVED_RESOURCES:
             if spec_resource and resources[resource]["name"] == spec_resource:
-                print("Exporting languages for " + resources[resource]["name"])
-                for id in languages.keys():
-                    t = Thread(target=export_resource_language, args=(resources[resource]["name"], id, False))
-                    threads.append(t)
-                    t.start()
+                en_file = {}
             elif not spec_resource:
-                print("Exporting languages for " + resources[resource]["name"])
-                for id in languages.keys():
-                    t = Thread(target=export_resource_language, args=(resources[resource]["name"], id, en[resource]))
-                    threads.append(t)
-                    t.start()
-
-    for thread in threads:
-        thread.join()
+                en_file = en.get(resource, {})
+            else:
+                continue
+            print("Exporting languages for " + resources[resource]["name"])
+            en_map = en_file.get("map", False)
+            en_hash = en_file.get("hash", "")
+            for id in languages.keys():
+                key = resource + "|" + id
+                state = {"last_update": stats[key], "en": en_hash} if stats and key in stats else None
+                if incremental and state and manifest.get(key) == state and os.path.exists(get_store_path(resources[resource]["name"], languages[id]["code"])):
+                    skipped += 1
+                    continue
+                jobs.append((resources[resource]["strings"], resources[resource]["name"], id, en_map, key, state))
+    jobs.sort(key=lambda job: job[0], reverse=True) # Start the largest resources first so they don't hold up the end of the export
+    if skipped:
+        print("Skipping " + str(skipped) + " resource languages unchanged since the last export")
+
+    def export_job(job):
+        return export_resource_language(job[1], job[2], job[3])
+    # Languages are downloaded in threads and converted in processes, so the conversions don't share one interpreter
+    converter = None
+    if jobs and not merge:
+        converter = start_conversion_pool({resources[resource]["name"]: en[resource]["map"] for resource in en})
+    try:
+        results = run_pool(export_job, jobs)
+        for i in range(len(jobs)):
+            if isinstance(results[i], dict):
+                results[i] = finish_conversion(jobs[i][1], jobs[i][2], results[i])
+    finally:
+        if converter != None:
+            converter.shutdown()
+    failed = [jobs[i] for i in range(len(jobs)) if not results[i]]
+    if stats:
+        for i in range(len(jobs)):
+            if results[i] and jobs[i][5]:
+                manifest[jobs[i][4]] = jobs[i][5]
+            elif jobs[i][4] in manifest:
+                del manifest[jobs[i][4]]
+        save_export_manifest(manifest)
+    print("Exported " + str(len(jobs) - len(failed)) + " of " + str(len(jobs)) + " resource languages")
+    for job in failed:
+        print("Error: Failed to export " + job[1] + " in language " + languages[job[2]]["name"])
+    if rate_limit["throttled"]:
+        print("Rate limited " + str(rate_limit["throttled"]) + " times. Concurrency was reduced to " + str(rate_limit["limit"]) + " of " + str(rate_limit["max"]) + " workers")
     print("Export finished")
-    return True
+    return len(failed) == 0
+
+# Call this function to get when each resource language of the project was last updated, keyed by "resource id|language id"
+def get_resource_language_stats():
+    stats = {}
+    url = BASE_URL + "/resource_language_stats?filter[project]=" + PROJECT_ID
+    while url:
+        response = do_request(url)
+        if "errors" in response:
+            print_error(response["errors"])
+            return False
+        for data in response["data"]:
+            key = data["relationships"]["resource"]["data"]["id"] + "|" + data["relationships"]["language"]["data"]["id"]
+            stats[key] = data["attributes"]["last_update"]
+        url = response.get("links", {}).get("next")
+    return stats
+
+# Call this function to load the state of each resource language at the previous export
+def load_export_manifest():
+    try:
+        return json.loads(file_get_contents(EXPORT_MANIFEST_FILE))
+    except (OSError, ValueError):
+        return {}
+
+# Call this function to save the state of each exported resource language
+def save_export_manifest(manifest):
+    try:
+        if not os.path.isdir(DOWNLOAD_FOLDER):
+            os.makedirs(DOWNLOAD_FOLDER)
+        file_put_contents(EXPORT_MANIFEST_FILE, json.dumps(manifest, indent=2, sort_keys=True))
+    except OSError as ex:
+        print("WARN: Unable to save the export manifest: " + str(ex))
+
+# Call this function to run the function for each job on a bounded pool of export_workers threads.
+# Returns the results in the order of the jobs, jobs raising an exception are reported as False
+def run_pool(function, jobs):
+    def run_job(job):
+        rate_limit_acquire()
+        success = False
+        try:
+            result = function(job)
+            success = result != False
+            return result
+        except Exception as ex:
+            print("Error: " + type(ex).__name__ + ": " + str(ex))
+            return False
+        finally:
+            rate_limit_release(success)
+    with ThreadPoolExecutor(max_workers=max(export_workers, 1)) as executor:
+        return list(executor.map(run_job, jobs))
+
+# Call this function to wait for a free request slot. The number of slots shrinks when Transifex rate limits requests
+def rate_limit_acquire():
+    with rate_limit_condition:
+        while rate_limit["active"] >= rate_limit["limit"]:
+            rate_limit_condition.wait()
+        rate_limit["active"] += 1
+
+# Call this function to free a request slot. Successful jobs slowly grow the number of slots back to the maximum
+def rate_limit_release(success):
+    with rate_limit_condition:
+        rate_limit["active"] -= 1
+        if success and rate_limit["limit"] < rate_limit["max"]:
+            rate_limit["successes"] += 1
+            if rate_limit["successes"] >= rate_limit["limit"]:
+                rate_limit["limit"] += 1
+                rate_limit["successes"] = 0
+        rate_limit_condition.notify_all()
+
+# Call this function when a request was rate limited to halve the number of slots. Returns the seconds to wait before retrying,
+# taken from Retry-After when valid and never more than RATE_LIMIT_MAX_DELAY
+def rate_limit_throttle(retry_after, attempt):
+    with rate_limit_condition:
+        rate_limit["throttled"] += 1
+        rate_limit["successes"] = 0
+        rate_limit["limit"] = max(1, rate_limit["limit"] // 2)
+    try:
+        delay = float(retry_after)
+        if delay != delay: # NaN
+            raise ValueError(retry_after)
+        return min(max(delay, 0), RATE_LIMIT_MAX_DELAY)
+    except (TypeError, ValueError):
+        return min(2 ** attempt, RATE_LIMIT_MAX_DELAY)
+
+# Call this function to set the maximum number of concurrent export workers
+def set_export_workers(workers):
+    global export_workers
+    export_workers = max(1, workers)
+    with rate_limit_condition:
+        rate_limit["limit"] = export_workers
+        rate_limit["max"] = export_workers
 
 # Call this function to upload the strings file supplied as the base file of the resource it is named for
 def run_upload(file_content, resource, branch):
     is_plurals = "Plurals" in resource
-    if not validate_file(file_content, is_plurals):
+    file_map = read_upload_file(file_content, is_plurals)
+    if file_map == None:
         print("Error: Invalid file content")
         return False
     if branch:
@@ -299,15 +593,14 @@ def run_upload(file_content, resource, branch):
     if resource_key:
         if branch:
             gitlab_resource_file = gitlab_download(resource)
-            if gitlab_resource_file:
+            if gitlab_resource_file != False:
                 resource = resource + "-" + branch
                 gitlab_map = content_to_map(gitlab_resource_file, False, is_plurals)
-                file_map = content_to_map(file_content, False, is_plurals) # This needs to be in the same parsed state as the gitlab map i.e: download content not the upload content
-                diff_map = {key: str for key, str in file_map.items() if key not in gitlab_map or not strings_equal(gitlab_map[key], str, is_plurals)}
-                if missing_developer_comments(diff_map, is_plurals):
+                file_map = convert_map(file_map, False, is_plurals) # This needs to be in the same parsed state as the gitlab map i.e: download content not the upload content
+                file_map = {key: str for key, str in file_map.items() if key not in gitlab_map or not strings_equal(gitlab_map[key], str, is_plurals)}
+                if missing_developer_comments(file_map, is_plurals):
                     print("Error: Uploading branch resource without developer comments is not allowed. Please provide the comments and try again.")
                     return False
-                file_content = map_to_content(diff_map, is_plurals)
             else:
                 print("Error: Failed to download gitlab file")
                 return False
@@ -316,7 +609,7 @@ def run_upload(file_content, resource, branch):
         while re.search("^[A-Z]{2,4}-\d+", jira_id) == None:
             jira_id = input("Please enter the JIRA ticket ID for this branch. e.g: IOS-1234: ")
         print("Uploading file")
-        if resource_put_english(resource_key, process_as_upload(file_content, is_plurals)):
+        if resource_put_english(resource_key, map_to_content(convert_map(file_map, True, is_plurals), is_plurals)):
             print("Upload completed")
             time.sleep(5)
             run_lock(resource, now)
@@ -332,23 +625,27 @@ def run_merge(resource, branch_resource, language = False, lang_code = "Base"):
         is_plurals = "Plurals" in resource
         print("Downloading and merging " + resource + " with " + branch_resource)
         if language:
-            resource_content = resource_get_language(resource, language, is_plurals)
+            resource_map = resource_get_language(resource, language, is_plurals, True)
         else:
-            resource_content = resource_get_english(resource, is_plurals)
-        if resource_content:
+            resource_map = resource_get_english(resource, is_plurals, None, True)
+        if resource_map != False:
             if language:
-                branch_resource_content = resource_get_language(branch_resource, language, is_plurals)
+                branch_resource_map = resource_get_language(branch_resource, language, is_plurals, True)
             else:
-                branch_resource_content = resource_get_english(branch_resource, is_plurals)
-            if branch_resource_content:
+                branch_resource_map = resource_get_english(branch_resource, is_plurals, None, True)
+            if branch_resource_map != False:
                 gitlab_resource_content = gitlab_download(resource, lang_code)
-                if gitlab_resource_content or "LTHPasscodeViewController" in resource:
+                if gitlab_resource_content != False or "LTHPasscodeViewController" in resource:
                     print("Downloads complete. Merging")
-                    merge_content = merge_strings(resource_content, branch_resource_content, False, is_plurals)
-                    if "LTHPasscodeViewController" not in resource:
-                        merge_content = merge_strings(gitlab_resource_content, merge_content, False, is_plurals)
-                    if merge_content:
-                        store_file(resource[:resource.find("-") if "-" in resource else len(resource)], merge_content, lang_code)
+                    counts = {"added": 0, "overridden": 0, "unchanged": 0}
+                    if "LTHPasscodeViewController" in resource:
+                        merge_map = merge_maps(resource_map, branch_resource_map, is_plurals, False, counts)
+                    else:
+                        gitlab_resource_map = content_to_map(gitlab_resource_content, False, is_plurals)
+                        merge_map = merge_maps(gitlab_resource_map, merge_maps(resource_map, branch_resource_map, is_plurals), is_plurals, False, counts)
+                    if merge_map:
+                        print("Merged {} keys: {} added, {} overridden, {} unchanged".format(len(merge_map), counts["added"], counts["overridden"], counts["unchanged"]))
+                        store_map(resource[:resource.find("-") if "-" in resource else len(resource)], merge_map, is_plurals, lang_code)
                         return True
                     else:
                         print("Error: Failed to merge resource files")
@@ -370,15 +667,9 @@ def run_lock(resource, update_time = 0, is_stores = False, updated_comments = Fa
             resource = PROJECT_ID + ":r:" + resource.lower()
         if updated_comments:
             # This data is fetched in a different way as time changes can't be detected when updating dev comments
-            response = {
-                "data": []
-            }
+            pages = []
         else:
-            response = do_request(BASE_URL + "/resource_strings?filter[resource]=" + resource)
-        if "errors" in response:
-            print_error(response["errors"])
-            print("Error: Unable to retrieve strings to lock")
-            return False
+            pages = iter_resource_string_pages(resource, ["tags", "instructions", "strings_datetime_modified"], update_time)
         to_lock = {}
         instructions = {}
         global jira_id
@@ -388,38 +679,37 @@ def run_lock(resource, update_time = 0, is_stores = False, updated_comments = Fa
             locked_tags.append('change_log')
         for language in languages:
             locked_tags.append("locked_" + languages[language]["code"])
-        for string in response["data"]:
-            mod_time = datetime.datetime.strptime(string["attributes"]["strings_datetime_modified"], "%Y-%m-%dT%H:%M:%SZ")
-            if int(mod_time.replace(tzinfo=datetime.timezone.utc).timestamp()) >= update_time:
-                string_tags = string["attributes"]["tags"]
-                not_fully_locked = False
-                for tag in locked_tags:
-                    if tag not in string_tags:
-                        not_fully_locked = True
-                        string_tags.append(tag)
-                if not_fully_locked:
-                    to_lock[string["id"]] = string_tags
-                    instructions[string["id"]] = jira_id + " " + (string["attributes"]["instructions"] if string["attributes"]["instructions"] else "")
+        for page in pages:
+            if "errors" in page:
+                print_error(page["errors"])
+                print("Error: Unable to retrieve strings to lock")
+                return False
+            for string in page["data"]:
+                mod_time = datetime.datetime.strptime(string["attributes"]["strings_datetime_modified"], "%Y-%m-%dT%H:%M:%SZ")
+                if int(mod_time.replace(tzinfo=datetime.timezone.utc).timestamp()) >= update_time:
+                    string_tags = string["attributes"]["tags"]
+                    present_tags = set(string_tags)
+                    missing_tags = [tag for tag in locked_tags if tag not in present_tags]
+                    if missing_tags:
+                        to_lock[string["id"]] = string_tags + missing_tags
+                        instructions[string["id"]] = jira_id + " " + (string["attributes"]["instructions"] if string["attributes"]["instructions"] else "")
         if to_lock:
             print("Locking strings")
-            update_string_meta(to_lock, instructions)
-            print("Strings locked successfully")
+            locked = update_string_meta(to_lock, instructions)
+            print("Locked " + str(locked) + " of " + str(len(to_lock)) + " strings")
         elif not updated_comments:
             print("Error: Resource is already locked or there are no strings to lock")
         if updated_comments: 
             print("Locking strings with updated developer comments.")
             to_lock = {}
             for id in updated_comments.keys():
-                not_fully_locked = False
-                string_tags = updated_comments[id]
-                for tag in locked_tags:
-                    if tag not in updated_comments[id]:
-                        not_fully_locked = True
-                        string_tags.append(tag)
-                if not_fully_locked:
-                    to_lock[id] = string_tags
-            update_string_meta(to_lock, instructions)
-            update_comments(to_lock)
+                present_tags = set(updated_comments[id])
+                missing_tags = [tag for tag in locked_tags if tag not in present_tags]
+                if missing_tags:
+                    to_lock[id] = updated_comments[id] + missing_tags
+            locked = update_string_meta(to_lock, instructions)
+            commented = update_comments(to_lock)
+            print("Locked " + str(locked) + " of " + str(len(to_lock)) + " strings and notified translators of " + str(commented) + " updated comments")
     else:
         print("Error: Resource " + resource + " not found")
 
@@ -428,37 +718,37 @@ def run_unlock(resource):
     if does_resource_exist(resource):
         print("Preparing to unlock strings")
         resource = PROJECT_ID + ":r:" + resource.lower()
-        response = do_request(BASE_URL + "/resource_strings?filter[resource]=" + resource)
-        if "errors" in response:
-            print_error(response["errors"])
-            print("Error: Unable to retrieve strings to lock")
-            return False
         to_unlock = {}
         languages = get_languages()
-        locked_tags = ["do_not_translate"]
+        locked_tags = set(["do_not_translate"])
         for language in languages:
-            locked_tags.append("locked_" + languages[language]["code"])
-        for string in response["data"]:
-            tmp = []
-            unlock = False
-            has_no_translate = False
-            for tag in string["attributes"]["tags"]:
-                if tag == "notranslate":
-                    has_no_translate = True
-                    tmp.append(tag)
-                    unlock = True
-                elif tag in locked_tags:
-                    unlock = True
-                else:
-                    tmp.append(tag)
-            if unlock:
-                if has_no_translate:
-                    tmp.append("do_not_translate")
-                to_unlock[string["id"]] = tmp
+            locked_tags.add("locked_" + languages[language]["code"])
+        for page in iter_resource_string_pages(resource, ["tags"]):
+            if "errors" in page:
+                print_error(page["errors"])
+                print("Error: Unable to retrieve strings to lock")
+                return False
+            for string in page["data"]:
+                tmp = []
+                unlock = False
+                has_no_translate = False
+                for tag in string["attributes"]["tags"]:
+                    if tag == "notranslate":
+                        has_no_translate = True
+                        tmp.append(tag)
+                        unlock = True
+                    elif tag in locked_tags:
+                        unlock = True
+                    else:
+                        tmp.append(tag)
+                if unlock:
+                    if has_no_translate:
+                        tmp.append("do_not_translate")
+                    to_unlock[string["id"]] = tmp
         if to_unlock:
             print("Unlocking strings")
-            update_string_meta(to_unlock, {})
-            print("Strings unlocked successfully")
+            unlocked = update_string_meta(to_unlock, {})
+            print("Unlocked " + str(unlocked) + " of " + str(len(to_unlock)) + " strings")
         else:
             print("Error: Resource is already unlocked or there are no strings")
     else:
@@ -538,19 +828,19 @@ def run_pruning(product = False):
         header = {
             "Authorization": "Bearer " + transifex_bot_token
         }
-        i = 30
         url = transifex_bot_url + "?o=prune&pid=ios"
         if product:
             url = url + "@" + str(product)
-        while i > 0:
-            request = Request(url, headers=header)
+        started = time.time()
+        delay = first_poll_delay("prune", 0)
+        polls = 0
+        while time.time() - started < PRUNE_TIMEOUT:
             try:
-                response = urlopen(request)
+                content = pooled_request(url, header).decode('utf8')
             except HTTPError as ex:
                 content = ex.read().decode('utf8')
                 print('Error: ' + content)
                 return False
-            content = response.read().decode('utf8')
             if content == '':
                 print('Empty response from the Transifex bot')
                 return False
@@ -560,10 +850,13 @@ def run_pruning(product = False):
                     if 'ok' in content:
                         if content['ok']:
                             if 'status' in content and content['status'] == 'pending':
-                                if i % 5 == 0:
+                                if polls % 5 == 0:
                                     print('Processing.....')
-                                time.sleep(10)
-                            i = i - 1
+                                polls += 1
+                            delay = poll_sleep_delay(delay, started, PRUNE_TIMEOUT)
+                            record_poll_sleep("prune", delay)
+                            time.sleep(delay)
+                            delay = next_poll_delay(delay, None, PRUNE_MAX_DELAY)
                         elif 'error' in content:
                             print('Error: ' + content['error'])
                             return False
@@ -571,6 +864,7 @@ def run_pruning(product = False):
                             print('Unknown error')
                             return False
                     elif len(content.keys()) > 0:
+                        record_poll_time("prune", 0, time.time() - started)
                         all_passed = True
                         for key in content.keys():
                             if "ok" in content[key]:
@@ -597,8 +891,9 @@ def run_pruning(product = False):
         print('Invalid environment variables')
 
 # Call this function to perform a request to Transifex
-def do_request(url, json_payload = None, type = "GET"):
-    is_git_request = "code.developers.mega.co.nz" in url
+# Returns None when the server answers a conditional request with 304 Not Modified
+def do_request(url, json_payload = None, type = "GET", response_headers = None, content_type = None, request_headers = None):
+    is_git_request = url.startswith(GITLAB_BASE_URL)
     if is_git_request:
         global gitlab_token
         headers = {
@@ -606,79 +901,393 @@ def do_request(url, json_payload = None, type = "GET"):
         }
     else:
         headers = HEADER
-    if json_payload == None:
-        request = Request(url, headers=headers)
-    else:
-        request = Request(url, headers=headers, data=json.dumps(json_payload).encode('utf8'))
+    if content_type or request_headers:
+        headers = dict(headers)
+        if content_type:
+            headers["Content-Type"] = content_type
+        if request_headers:
+            headers.update(request_headers)
+    data = None
+    if json_payload != None:
+        data = json.dumps(json_payload).encode('utf8')
         if type == "GET":
             type = "POST"
-    request.get_method = lambda: type
-    try:
-        response = urlopen(request)
-    except HTTPError as e:
-        if is_git_request:
-            if e.code == 401:
-                print("Error: Invalid Gitlab token")
-                return False
-            elif e.code == 404:
-                print("Error: Unable to find file in Gitlab")
-                return False
-            else:
-                print("Error: Unknown error from Gitlab")
-                return False
-        elif e.code == 303:
-            raise e
-        elif e.code == 204:
-            return "No Content"
-        else:
-            errContent = json.loads(e.read().decode('utf-8'))
-            errMsg = "Error: Requesting " + url + " failed"
-            if json_payload != None:
-                errMsg = errMsg + " with payload " + json.dumps(json_payload)
-            print(errMsg)
-            return errContent
-    res = response.read()
+    attempt = 0
+    while True:
+        try:
+            res = pooled_request(url, headers, data, type, response_headers)
+            break
+        except HTTPError as e:
+            if e.code == 429 and attempt < RATE_LIMIT_RETRIES:
+                attempt += 1
+                delay = rate_limit_throttle(e.headers.get("Retry-After"), attempt)
+                record_retry(endpoint_class(type, url), delay)
+                time.sleep(delay)
+                continue
+            if e.code == 304:
+                return None
+            return handle_request_error(e, url, json_payload, is_git_request)
     if res == "":
         return {"code": res.code}
     if is_git_request:
         return res
     return json.loads(res)
 
-# Call this function to get all resources in Transifex
-def get_resources():
-    global resources
-    if resources:
+# Call this function to perform a GET request through the on-disk HTTP cache. Cached responses are revalidated with their ETag and
+# Last-Modified validators, used without revalidating while younger than ttl seconds (http_cache_ttl by default) and used when offline
+def do_cached_request(url, ttl = None):
+    if not http_cache_enabled:
+        return do_request(url)
+    if ttl == None:
+        ttl = http_cache_ttl
+    is_git_request = url.startswith(GITLAB_BASE_URL)
+    entry = http_cache_load(url)
+    if entry and ttl > 0 and time.time() - entry["stored"] < ttl:
+        http_cache_count("fresh")
+        return http_cache_body(entry, is_git_request)
+    request_headers = {}
+    if entry and entry["etag"]:
+        request_headers["If-None-Match"] = entry["etag"]
+    if entry and entry["last_modified"]:
+        request_headers["If-Modified-Since"] = entry["last_modified"]
+    response_headers = {}
+    try:
+        response = do_request(url, None, "GET", response_headers, None, request_headers)
+    except (OSError, http.client.HTTPException) as ex:
+        if entry == None:
+            raise
+        print("WARN: Request failed (" + str(ex) + "). Using the cached response for " + url)
+        http_cache_count("offline")
+        return http_cache_body(entry, is_git_request)
+    if response == None and entry:
+        http_cache_count("not_modified")
+        http_cache_store(url, entry["etag"], entry["last_modified"], None)
+        return http_cache_body(entry, is_git_request)
+    if not response or (not is_git_request and "errors" in response):
+        return response
+    http_cache_count("fetched")
+    body = response if is_git_request else json.dumps(response).encode("utf-8")
+    http_cache_store(url, response_headers.get("etag"), response_headers.get("last-modified"), body)
+    return response
+
+# Call this function to load the cached validators and body of a url. Returns None when the url is not cached
+def http_cache_load(url):
+    path = HTTP_CACHE_FOLDER + hashlib.sha256(url.encode("utf-8")).hexdigest()
+    try:
+        entry = json.loads(file_get_contents(path + ".json"))
+        with gzip.open(path + ".gz", "rb") as file:
+            entry["body"] = file.read()
+    except (OSError, ValueError, EOFError):
+        return None
+    return entry
+
+# Call this function to store the validators and gzip compressed body of a url. A body of None only refreshes the stored time
+def http_cache_store(url, etag, last_modified, body):
+    path = HTTP_CACHE_FOLDER + hashlib.sha256(url.encode("utf-8")).hexdigest()
+    try:
+        if not os.path.isdir(HTTP_CACHE_FOLDER):
+            os.makedirs(HTTP_CACHE_FOLDER, exist_ok=True)
+        if body != None:
+            tmp_path = temp_path(path + ".gz")
+            try:
+                with gzip.open(tmp_path, "wb") as file:
+                    file.write(body)
+                os.replace(tmp_path, path + ".gz")
+            except:
+                remove_temp_file(tmp_path)
+                raise
+        file_put_contents(path + ".json", json.dumps({"url": url, "etag": etag, "last_modified": last_modified, "stored": time.time()}))
+    except OSError as ex:
+        print("WARN: Unable to write the HTTP cache: " + str(ex))
+
+# Call this function to return a cached body in the same form as do_request
+def http_cache_body(entry, is_git_request):
+    if is_git_request:
+        return entry["body"]
+    return json.loads(entry["body"].decode("utf-8"))
+
+# Call this function to count how a request was answered by the HTTP cache
+def http_cache_count(result):
+    with http_cache_lock:
+        http_cache_stats[result] += 1
+
+# Call this function to print how many requests were answered by the HTTP cache
+def print_http_cache_stats():
+    print("HTTP cache: {} fresh, {} not modified, {} fetched, {} used offline".format(http_cache_stats["fresh"], http_cache_stats["not_modified"], http_cache_stats["fetched"], http_cache_stats["offline"]))
+    if local_git_enabled:
+        print("Local git: {} files read, {} not found, {} downloaded from Gitlab instead".format(git_objects_stats["read"], git_objects_stats["missing"], git_objects_stats["api"]))
+
+# Call this function to send a request over a pooled keep-alive connection to the host of the url and return the response body.
+# Redirects are not followed, any non 2xx response raises a HTTPError in the same way as urlopen.
+# The response headers are added to response_headers with lower case names when given
+def pooled_request(url, headers = {}, data = None, type = "GET", response_headers = None):
+    return b"".join(pooled_stream(url, headers, data, type, response_headers, None))
+
+# Call this function to send a request over a pooled keep-alive connection and yield the response body in chunks of chunk_size bytes,
+# or in one piece when chunk_size is None. The connection only goes back to the pool once the whole body has been read.
+# Non 2xx responses raise a HTTPError and the response headers are added to response_headers in the same way as pooled_request
+def pooled_stream(url, headers = {}, data = None, type = "GET", response_headers = None, chunk_size = STREAM_CHUNK_SIZE):
+    parts = urlsplit(url)
+    host = (parts.scheme, parts.netloc)
+    path = parts.path or "/"
+    if parts.query:
+        path = path + "?" + parts.query
+    headers = dict(headers)
+    headers.setdefault("User-Agent", USER_AGENT)
+    endpoint = endpoint_class(type, url)
+    while True:
+        connection, reused = connection_get(host)
+        started = time.time()
+        try:
+            connection.request(type, path, body=data, headers=headers)
+            response = connection.getresponse()
+            break
+        except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError):
+            connection.close()
+            if reused: # The server closed the idle connection, retry once on a new one
+                with connection_pool_lock:
+                    connection_stats["stale"] += 1
+                record_retry(endpoint)
+                continue
+            record_request(endpoint, time.time() - started, data, 0, None)
+            raise
+        except:
+            connection.close()
+            record_request(endpoint, time.time() - started, data, 0, None)
+            raise
+    if response_headers != None:
+        for name, value in response.getheaders():
+            response_headers[name.lower()] = value
+    received = 0
+    finished = False
+    try:
+        if response.status < 200 or response.status >= 300:
+            body = response.read()
+            received = len(body)
+            finished = True
+            raise HTTPError(url, response.status, response.reason, response.msg, io.BytesIO(body))
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            received += len(chunk)
+            yield chunk
+        finished = True
+    finally:
+        record_request(endpoint, time.time() - started, data, received, response.status if finished else None)
+        if finished and not response.will_close:
+            connection_put(host, connection)
+        else:
+            connection.close()
+
+# Call this function to take an idle connection to the host from the pool or open a new one. Returns the connection and if it was reused
+def connection_get(host):
+    with connection_pool_lock:
+        connection_stats["requests"] += 1
+        idle = connection_pools.get(host)
+        if idle:
+            connection_stats["reused"] += 1
+            return idle.pop(), True
+        connection_stats["opened"] += 1
+    if host[0] == "http":
+        return http.client.HTTPConnection(host[1], timeout=REQUEST_TIMEOUT), False
+    return http.client.HTTPSConnection(host[1], timeout=REQUEST_TIMEOUT), False
+
+# Call this function to return a connection to the pool once its response has been read
+def connection_put(host, connection):
+    with connection_pool_lock:
+        idle = connection_pools.setdefault(host, [])
+        if len(idle) < CONNECTION_POOL_SIZE:
+            idle.append(connection)
+            return
+    connection.close()
+
+# Call this function to print how many requests reused an existing connection
+def print_connection_stats():
+    print("Connections: {} requests over {} connections ({} reused, {} stale connections retried)".format(connection_stats["requests"] - connection_stats["stale"], connection_stats["opened"], connection_stats["reused"], connection_stats["stale"]))
+
+# Call this function to return the endpoint class a request is counted under: the method and the API collection, "<job type> status" for
+# async job polls, "gitlab" for Gitlab, "bot" for the Transifex bot and "file" for downloads of finished jobs
+def endpoint_class(type, url):
+    if url.startswith(GITLAB_BASE_URL):
+        return type + " gitlab"
+    if transifex_bot_url and url.startswith(transifex_bot_url):
+        return type + " bot"
+    if not url.startswith(BASE_URL):
+        return type + " file"
+    parts = urlsplit(url[len(BASE_URL):]).path.strip("/").split("/")
+    if parts[0] == "projects":
+        return type + " " + parts[-1]
+    if "_async_" in parts[0] and len(parts) > 1:
+        return type + " " + parts[0] + " status"
+    return type + " " + parts[0]
+
+# Call this function to return the statistics of an endpoint class, creating them on first use. Must be called with http_stats_lock held
+def endpoint_stats(endpoint):
+    stats = http_stats.get(endpoint)
+    if stats == None:
+        stats = {"requests": 0, "errors": 0, "retries": 0, "retry_sleep": 0, "seconds": 0, "max_seconds": 0, "sent": 0, "received": 0, "histogram": [0] * (len(HTTP_STATS_BUCKETS) + 1)}
+        http_stats[endpoint] = stats
+    return stats
+
+# Call this function to record a finished request and the number of bytes received. A status of None records a request that failed
+# without a complete response
+def record_request(endpoint, seconds, data, received, status):
+    bucket = 0
+    while bucket < len(HTTP_STATS_BUCKETS) and seconds > HTTP_STATS_BUCKETS[bucket]:
+        bucket += 1
+    with http_stats_lock:
+        stats = endpoint_stats(endpoint)
+        stats["requests"] += 1
+        if status == None or status >= 400:
+            stats["errors"] += 1
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        stats["sent"] += len(data) if data else 0
+        stats["received"] += received
+        stats["histogram"][bucket] += 1
+
+# Call this function to record that a request is retried, after sleeping for the given number of seconds
+def record_retry(endpoint, sleep = 0):
+    with http_stats_lock:
+        stats = endpoint_stats(endpoint)
+        stats["retries"] += 1
+        stats["retry_sleep"] += sleep
+
+# Call this function to record the time slept before polling an async job of the given kind
+def record_poll_sleep(kind, seconds):
+    with http_stats_lock:
+        stats = poll_stats.setdefault(kind, {"polls": 0, "sleep": 0})
+        stats["polls"] += 1
+        stats["sleep"] += seconds
+
+# Call this function to print the request statistics of each endpoint class and the time slept polling async jobs
+def print_http_stats(elapsed):
+    print("Requests in {:.1f}s:".format(elapsed))
+    for endpoint in sorted(http_stats):
+        stats = http_stats[endpoint]
+        print("  {}: {} requests, {} errors, {} retries ({:.1f}s waiting), {:.0f}ms average, {:.0f}ms max, {} KB sent, {} KB received".format(endpoint, stats["requests"], stats["errors"], stats["retries"], stats["retry_sleep"], stats["seconds"] * 1000 / max(stats["requests"], 1), stats["max_seconds"] * 1000, stats["sent"] // 1024, stats["received"] // 1024))
+        buckets = []
+        for i in range(len(stats["histogram"])):
+            if stats["histogram"][i]:
+                label = "<=" + str(HTTP_STATS_BUCKETS[i]) + "s" if i < len(HTTP_STATS_BUCKETS) else ">" + str(HTTP_STATS_BUCKETS[-1]) + "s"
+                buckets.append(label + ": " + str(stats["histogram"][i]))
+        print("    " + ", ".join(buckets))
+    for kind in sorted(poll_stats):
+        print("  {} polls: {} sleeps, {:.1f}s".format(kind, poll_stats[kind]["polls"], poll_stats[kind]["sleep"]))
+
+# Call this function to write the request statistics to a JSON file
+def save_http_stats(path, elapsed):
+    stats = {
+        "elapsed": elapsed,
+        "buckets": HTTP_STATS_BUCKETS,
+        "endpoints": http_stats,
+        "polls": poll_stats
+    }
+    try:
+        file_put_contents(path, json.dumps(stats, indent=2, sort_keys=True))
+        print("Request statistics saved to " + path)
+    except OSError as ex:
+        print("WARN: Unable to write the request statistics: " + str(ex))
+
+# Call this function to handle a failed request to Transifex or Gitlab
+def handle_request_error(e, url, json_payload, is_git_request):
+    if is_git_request:
+        if e.code == 401:
+            print("Error: Invalid Gitlab token")
+            return False
+        elif e.code == 404:
+            print("Error: Unable to find file in Gitlab")
+            return False
+        else:
+            print("Error: Unknown error from Gitlab")
+            return False
+    elif e.code == 303:
+        raise e
+    elif e.code == 204:
+        return "No Content"
+    else:
+        errContent = json.loads(e.read().decode('utf-8'))
+        errMsg = "Error: Requesting " + url + " failed"
+        if json_payload != None:
+            errMsg = errMsg + " with payload " + json.dumps(json_payload)
+        print(errMsg)
+        return errContent
+
+# Call this function to get all resources in Transifex, following the next links. The resources are loaded once and shared between threads
+def get_resources(refresh = False):
+    global resources, resource_index
+    with resource_lock:
+        if resources and not refresh:
+            return resources
+        loaded = {}
+        url = BASE_URL + "/resources?filter[project]=" + PROJECT_ID
+        while url:
+            response = do_cached_request(url, 0 if refresh else None)
+            if "errors" in response:
+                print("Error: Failed to fetch resource data")
+                print_error(response["errors"])
+                return resources
+            for data in response["data"]:
+                loaded[data["id"]] = {
+                    "name": data["attributes"]["name"],
+                    "slug": data["attributes"]["slug"],
+                    "strings": data["attributes"]["string_count"]
+                }
+            url = response.get("links", {}).get("next")
+        resource_index = {}
+        for key in loaded:
+            resource_index[loaded[key]["name"]] = key
+        resource_lookups.clear()
+        resources = loaded
         return resources
-    response = do_request(BASE_URL + "/resources?filter[project]=" + PROJECT_ID)
+
+# Call this function to look up a single resource by its slug without listing the whole project. Returns the resource id or False
+def find_resource(resource_name):
+    with resource_lock:
+        if resource_name in resource_lookups:
+            return resource_lookups[resource_name]
+    response = do_request(BASE_URL + "/resources?filter[project]=" + PROJECT_ID + "&filter[slug]=" + resource_name.lower())
     if "errors" in response:
-        print("Error: Failed to fetch resource data")
-        print_error(response["errors"])
-        return resources
+        return None
+    key = False
     for data in response["data"]:
-        resources[data["id"]] = {
-            "name": data["attributes"]["name"],
-            "strings": data["attributes"]["string_count"]
-        }
-    return resources
+        if data["attributes"]["name"] == resource_name:
+            key = data["id"]
+    with resource_lock:
+        resource_lookups[resource_name] = key
+    return key
 
 # Call this function to check if resource_name exists in Transifex
 def does_resource_exist(resource_name, refresh = False):
-    global resources
     if refresh:
-        resources = {}
-    if len(resources) == 0:
-        resources = get_resources()
-    for key in resources:
-        if resources[key]["name"] == resource_name:
+        get_resources(True)
+    elif not resources:
+        # A resource created with a custom slug is only found by listing the project, so only trust a hit
+        key = find_resource(resource_name)
+        if key:
             return key
-    return False
+        get_resources()
+    return resource_index.get(resource_name, False)
+
+# Call this function to iterate over every page of the strings of a resource, following the next links. Only the given attributes are
+# requested and strings modified before modified_since (unix time) are filtered out by Transifex. Stops after a page with errors
+def iter_resource_string_pages(resource_id, fields = None, modified_since = 0):
+    url = BASE_URL + "/resource_strings?filter[resource]=" + resource_id
+    if modified_since:
+        url = url + "&filter[date_modified][gte]=" + datetime.datetime.fromtimestamp(modified_since, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if fields:
+        url = url + "&fields[resource_strings]=" + ",".join(fields)
+    while url:
+        response = do_request(url)
+        yield response
+        if "errors" in response:
+            return
+        url = response.get("links", {}).get("next")
 
 # Call this function to get the strings data from the resource
 def get_strings_data(resource, is_branch):
-    url = BASE_URL + "/resource_strings?filter[resource]=" + PROJECT_ID + ":r:" + resource.lower()
-    while url != None:
-        response = do_request(url)
-        url = None
+    for response in iter_resource_string_pages(PROJECT_ID + ":r:" + resource.lower()):
         if "errors" in response:
             print_error(response["errors"])
             return False
@@ -692,8 +1301,6 @@ def get_strings_data(resource, is_branch):
                 }
             else:
                 base_strings.append(string["attributes"]["string_hash"])
-        if "next" in response["links"] and response["links"]["next"] != None:
-            url = response["links"]["next"]
     return True
 
 # Call this function to get the available languages for the project
@@ -701,24 +1308,33 @@ def get_languages():
     global language_cache
     if language_cache:
         return language_cache
-    response = do_request(BASE_URL + "/projects/" + PROJECT_ID + "/languages")
+    response = do_cached_request(BASE_URL + "/projects/" + PROJECT_ID + "/languages")
     if "errors" in response:
         print("Error: Failed to retrieve languages")
         print_error(response["errors"])
         return language_cache
+    loaded = {}
     for data in response["data"]:
-        language_cache[data["id"]] = {
+        loaded[data["id"]] = {
             "code": data["attributes"]["code"],
             "name": data["attributes"]["name"]
         }
+    language_cache = loaded
     return language_cache
 
+# Call this function to request the resources and languages of the project at the same time before they are needed
+def prefetch_project_data():
+    with ThreadPoolExecutor(2) as executor:
+        futures = [executor.submit(get_resources), executor.submit(get_languages)]
+        for future in futures:
+            future.result()
+
 # Call this function to return the username for the given id or the id if not found
 def get_username_from_id(id):
     global user_cache
     if id in user_cache:
         return user_cache[id]
-    response = do_request(BASE_URL + "/users/" + id)
+    response = do_cached_request(BASE_URL + "/users/" + id)
     if "errors" in response:
         return id
     if response["data"] and response["data"]["attributes"]["username"]:
@@ -726,8 +1342,9 @@ def get_username_from_id(id):
         return user_cache[id]
     return id
 
-# Call this function to get the English file for the given resource
-def resource_get_english(resource, is_plurals = False):
+# Call this function to get the English file for the given resource. With a destination the file is streamed to it instead of returned
+# and with as_map set the file is streamed and returned as a strings mapping
+def resource_get_english(resource, is_plurals = False, destination = None, as_map = False):
     payload = {
         "data": {
             "attributes": {
@@ -747,17 +1364,19 @@ def resource_get_english(resource, is_plurals = False):
     }
     if resource in [STORES_IOS_ID, STORES_IOS_VPN_ID, STORES_IOS_PWD_ID]:
         payload["data"]["relationships"]["resource"]["data"]["id"] = resource
-    if is_plurals:
-        content = file_download(payload)
+    encoding = "utf-8" if is_plurals else "utf-16"
+    if as_map:
+        content = file_download_map(payload, encoding, is_plurals)
     else:
-        content = file_download(payload, "utf-16")
+        content = file_download(payload, encoding, destination)
     if content == False:
         print("Error: Unable to download English resource file for " + resource)
         return False
     return content
 
-# Call this function to get the specified languages file for the given resource
-def resource_get_language(resource, lang, is_plurals = False):
+# Call this function to get the specified languages file for the given resource. With as_map set the file is streamed and returned
+# as a strings mapping. With a destination the file is streamed to it and the sha256 hex digest of its content is returned
+def resource_get_language(resource, lang, is_plurals = False, as_map = False, destination = None):
     payload = {
         "data": {
             "attributes": {
@@ -782,10 +1401,11 @@ def resource_get_language(resource, lang, is_plurals = False):
             "type": "resource_translations_async_downloads"
         }
     }
-    if is_plurals:
-        content = file_download(payload)
+    encoding = "utf-8" if is_plurals else "utf-16"
+    if as_map:
+        content = file_download_map(payload, encoding, is_plurals)
     else:
-        content = file_download(payload, "utf-16")
+        content = file_download(payload, encoding, destination)
     if content == False:
         print("Error: Unable to download English resource file for " + resource)
         return False
@@ -814,33 +1434,183 @@ def resource_put_english(resource, content, force = False):
     return file_upload(payload)
 
 # Call this function to download the gitlab strings file for the resource
+# With local_git_enabled the file is read from origin/git_branch in the local clone, and only downloaded when that branch is not found
+# Returns the file content, an empty string for an empty file, or False when it can't be read
 def gitlab_download(resource, language = "Base"):
     if "LTHPasscodeViewController" in resource:
         return False
     global config_map
+    if language in REMAPPED_CODE:
+        language = REMAPPED_CODE[language]
+    if local_git_enabled:
+        content = git_object_read(config_map[resource] + language + ".lproj/" + get_file_basename(resource))
+        if content != None:
+            return content.decode("utf-8") if content != False else False
     url = GITLAB_URL.replace("$file", get_file_basename(resource)).replace("$path", config_map[resource].replace("/", "%2F"))
     if language != "Base":
-        if language in REMAPPED_CODE:
-            language = REMAPPED_CODE[language]
         url = url.replace("Base.lproj", language + ".lproj")
-    content = do_request(url)
-    if content:
+    content = do_cached_request(url)
+    if isinstance(content, bytes):
         return content.decode("utf-8")
     return False
 
+# Call this function to read a file from origin/git_branch in the local clone through a single git cat-file --batch process shared by
+# every thread. All the files of a run are read from the commit the branch pointed to at the first read.
+# Returns the file bytes, False if the file is not in the branch, or None if the branch can't be read locally
+def git_object_read(path):
+    with git_objects_lock:
+        if git_objects["failed"]:
+            git_objects_stats["api"] += 1
+            return None
+        if git_objects["process"] == None:
+            try:
+                commit = subprocess.check_output(["git", "rev-parse", "--verify", "--quiet", "origin/" + git_branch + "^{commit}"], cwd=git_path, universal_newlines=True, stderr=subprocess.DEVNULL).strip()
+                git_objects["process"] = subprocess.Popen(["git", "cat-file", "--batch"], cwd=git_path, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                git_objects["commit"] = commit
+                atexit.register(close_git_objects)
+            except (OSError, subprocess.CalledProcessError):
+                print("WARN: Cannot read origin/" + git_branch + " from the local clone. Downloading the files from Gitlab")
+                git_objects["failed"] = True
+                git_objects_stats["api"] += 1
+                return None
+        process = git_objects["process"]
+        try:
+            process.stdin.write((git_objects["commit"] + ":" + path + "\n").encode("utf-8"))
+            process.stdin.flush()
+            header = process.stdout.readline().decode("utf-8").rstrip("\n")
+            if header == "" or header.endswith(" missing") or header.endswith(" ambiguous"):
+                if header == "":
+                    raise OSError("git cat-file exited")
+                git_objects_stats["missing"] += 1
+                return False
+            object_type, size = header.split(" ")[1:3]
+            data = process.stdout.read(int(size) + 1)[:-1] # The content is followed by a new line
+        except (OSError, ValueError) as ex:
+            print("WARN: Cannot read " + path + " from the local clone, downloading the files from Gitlab: " + str(ex))
+            git_objects["failed"] = True
+            git_objects_stats["api"] += 1
+            return None
+        if object_type != "blob":
+            git_objects_stats["missing"] += 1
+            return False
+        git_objects_stats["read"] += 1
+        return data
+
+# Call this function to end the git cat-file process started by git_object_read, if any. Registered to run at exit once it is started
+def close_git_objects():
+    with git_objects_lock:
+        process = git_objects["process"]
+        git_objects["process"] = None
+    if process != None:
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        process.wait()
+
 # Call this function to download a file defined by the payload
-def file_download(payload, encoding = "utf-8"):
+# With a destination the file is streamed to it and the sha256 hex digest of its UTF-8 encoded content is returned instead
+def file_download(payload, encoding = "utf-8", destination = None):
     url = BASE_URL + "/" + payload["data"]["type"]
     response = do_request(url, payload)
     if "errors" in response:
         print_error(response["errors"])
         return False
     wait_url = response["data"]["links"]["self"]
-    data = await_download(wait_url, encoding)
+    resource_id = payload["data"]["relationships"]["resource"]["data"]["id"]
+    size = resources[resource_id]["strings"] if resource_id in resources else 0
+    data = await_download(wait_url, encoding, size, destination)
     if data == False:
         return False
     return data
 
+# Call this function to download a file defined by the payload as a strings mapping. The file is streamed to a temporary file and parsed
+# from there, so neither the downloaded bytes nor the whole text are ever held in memory
+def file_download_map(payload, encoding, is_plurals):
+    file_path = temp_path(DOWNLOAD_FOLDER + "download")
+    digest = file_download(payload, encoding, file_path)
+    if digest == False:
+        return False
+    try:
+        map = load_downloaded_map(file_path, digest, is_plurals)
+    finally:
+        os.remove(file_path)
+    return map
+
+# Call this function to parse a downloaded file to a strings mapping, reusing the cached mapping of the content with the given digest
+def load_downloaded_map(file_path, digest, is_plurals):
+    cache_key = map_cache_digest_key(digest, False, is_plurals)
+    map = map_cache_get(cache_key)
+    if map == None:
+        map = parse_file_to_map(file_path, False, is_plurals)
+        map_cache_put(cache_key, map)
+    return map
+
+# Call this function to set up a conversion process with the English mappings of the exported resources and the cache settings of the
+# exporting process, as processes started with spawn don't share any state with it
+def init_conversion_process(english, cache_enabled, cache_size):
+    global export_english, map_cache_enabled, map_cache_size
+    export_english = english
+    map_cache_enabled = cache_enabled
+    map_cache_size = cache_size
+
+# Call this function in a conversion process to parse a downloaded language file, merge it into the English mapping of the resource and
+# write the strings file to output_path. Returns the parsed strings cache counts of the conversion for the exporting process to add up
+def convert_language_file(resource, download_path, digest, is_plurals, output_path):
+    for key in map_cache_stats:
+        map_cache_stats[key] = 0
+    map = load_downloaded_map(download_path, digest, is_plurals)
+    if resource in export_english:
+        map = merge_maps(export_english[resource], map, is_plurals, True)
+    with open(output_path, "w") as file:
+        write_content(file, map, is_plurals)
+    return dict(map_cache_stats)
+
+# Call this function to start the process pool converting the downloaded languages of an export. Returns None when cpu_workers is 1
+# or processes can't be started, in which case the languages are converted in the download threads
+def start_conversion_pool(english):
+    if cpu_workers <= 1:
+        return None
+    try:
+        # Spawned processes are safe to start while the download threads are running, and match the default on macOS
+        return ProcessPoolExecutor(max_workers=cpu_workers, mp_context=multiprocessing.get_context("spawn"), initializer=init_conversion_process,
+                                   initargs=({resource: dict(english[resource]) for resource in english}, map_cache_enabled, map_cache_size))
+    except (OSError, ImportError, NotImplementedError, ValueError) as ex:
+        print("WARN: Unable to start the conversion processes, converting in the download threads: " + str(ex))
+        return None
+
+# Call this function to set the number of processes converting the downloaded languages during export
+def set_cpu_workers(workers):
+    global cpu_workers
+    cpu_workers = max(1, workers)
+
+# Call this function to stream the body of a url to a file, decoding it incrementally so only a chunk is held in memory at a time.
+# Returns the sha256 hex digest of the UTF-8 encoded text, the same content hash the map cache uses
+def download_to_file(url, encoding, destination):
+    digest = hashlib.sha256()
+    tmp_path = temp_path(destination)
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="") as file:
+            for text in iter_decoded(pooled_stream(url), encoding):
+                digest.update(text.encode("utf-8"))
+                file.write(text)
+    except:
+        remove_temp_file(tmp_path)
+        raise
+    replace_if_changed(tmp_path, destination)
+    return digest.hexdigest()
+
+# Call this function to decode a stream of byte chunks into text chunks. Multi-byte characters split between chunks are handled
+def iter_decoded(chunks, encoding):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", True)
+    if text:
+        yield text
+
 # Call this function to upload a resource/translation file to Transifex
 def file_upload(payload):
     url = BASE_URL + "/" + payload["data"]["type"]
@@ -849,18 +1619,20 @@ def file_upload(payload):
         print_error(response["errors"])
         return False
     wait_url = response["data"]["links"]["self"]
-    return await_upload(wait_url)
-
-# Call this function to await a file download request
-def await_download(url, encoding = "utf-8"):
-    class NoRedirect(HTTPRedirectHandler):
-        def redirect_request(self, req, fp, code, msg, headers, newurl):
-            return None
-    opener = build_opener(NoRedirect)
-    install_opener(opener)
-    for i in range(50):
+    return await_upload(wait_url, len(payload["data"]["attributes"]["content"]))
+
+# Call this function to await a file download request. The size of the resource is used to predict when the file will be ready.
+# With a destination the file is streamed to it and the digest from download_to_file is returned instead of the content
+def await_download(url, encoding = "utf-8", size = 0, destination = None):
+    started = time.time()
+    delay = first_poll_delay("download", size)
+    while time.time() - started < POLL_TIMEOUT:
+        delay = poll_sleep_delay(delay, started, POLL_TIMEOUT)
+        record_poll_sleep("download", delay)
+        time.sleep(delay)
+        headers = {}
         try:
-            response = do_request(url)
+            response = do_request(url, None, "GET", headers)
             if "errors" in response:
                 print_error(response["errors"])
                 return False
@@ -870,21 +1642,28 @@ def await_download(url, encoding = "utf-8"):
                 return False
         except HTTPError as e:
             if e.code == 303:
-                file = urlopen(e.headers["Location"])
-                response = file.read().decode(encoding)
-                return response
+                record_poll_time("download", size, time.time() - started)
+                if destination:
+                    return download_to_file(e.headers["Location"], encoding, destination)
+                return "".join(iter_decoded(pooled_stream(e.headers["Location"]), encoding))
             elif e.code != 200:
                 response = json.loads(e.read().decode("utf-8"))
                 if "errors" in response:
                     print_error(response["errors"])
                 return False
-        time.sleep(2)
+        delay = next_poll_delay(delay, headers.get("retry-after"))
     return False
 
-# Call this function to await a file upload request
-def await_upload(url):
-    for i in range(50):
-        response = do_request(url)
+# Call this function to await a file upload request. The size of the uploaded content is used to predict when the upload will be processed
+def await_upload(url, size = 0):
+    started = time.time()
+    delay = first_poll_delay("upload", size)
+    while time.time() - started < POLL_TIMEOUT:
+        delay = poll_sleep_delay(delay, started, POLL_TIMEOUT)
+        record_poll_sleep("upload", delay)
+        time.sleep(delay)
+        headers = {}
+        response = do_request(url, None, "GET", headers)
         if "errors" in response:
             print_error(response["errors"])
             return False
@@ -893,10 +1672,63 @@ def await_upload(url):
                 print_error(response["data"]["attributes"]["errors"])
             return False
         elif response["data"]["attributes"]["status"] != "pending":
+            record_poll_time("upload", size, time.time() - started)
             return True
-        time.sleep(2)
+        delay = next_poll_delay(delay, headers.get("retry-after"))
     return False
 
+# Call this function to return the delay before the first poll of an async job, based on how long previous jobs of a similar size took
+def first_poll_delay(kind, size):
+    times = load_poll_history().get(kind, {}).get(poll_size_bucket(size), [])
+    if not times:
+        return POLL_FIRST_DELAY
+    times = sorted(times)
+    return min(max(times[len(times) // 2] * 0.8, POLL_FIRST_DELAY), POLL_MAX_DELAY)
+
+# Call this function to return the delay before the next poll. Backs off exponentially with jitter unless the server sent a valid
+# Retry-After delay, which is never more than max_delay
+def next_poll_delay(delay, retry_after = None, max_delay = POLL_MAX_DELAY):
+    try:
+        retry_delay = float(retry_after)
+        if not math.isfinite(retry_delay):
+            raise ValueError(retry_after)
+        return min(max(retry_delay, 0), max_delay)
+    except (TypeError, ValueError):
+        return min(delay * POLL_BACKOFF, max_delay) * random.uniform(0.8, 1.2)
+
+# Call this function to return the delay before the next poll cut to the time left before the timeout of a poll started at started
+def poll_sleep_delay(delay, started, timeout):
+    return max(min(delay, started + timeout - time.time()), 0)
+
+# Call this function to return the history bucket for a job size. Sizes within a factor of 2 share a bucket
+def poll_size_bucket(size):
+    return str(int(math.log(size + 1, 2)))
+
+# Call this function to load the durations of previous async jobs
+def load_poll_history():
+    global poll_history
+    with poll_history_lock:
+        if poll_history == None:
+            try:
+                poll_history = json.loads(file_get_contents(POLL_HISTORY_FILE))
+            except (OSError, ValueError):
+                poll_history = {}
+        return poll_history
+
+# Call this function to save how long an async job of the given size took to finish
+def record_poll_time(kind, size, seconds):
+    history = load_poll_history()
+    with poll_history_lock:
+        times = history.setdefault(kind, {}).setdefault(poll_size_bucket(size), [])
+        times.append(round(seconds, 2))
+        del times[:-POLL_HISTORY_SIZE]
+        try:
+            if not os.path.isdir(DOWNLOAD_FOLDER):
+                os.makedirs(DOWNLOAD_FOLDER)
+            file_put_contents(POLL_HISTORY_FILE, json.dumps(history))
+        except OSError as ex:
+            print("WARN: Unable to save the polling history: " + str(ex))
+
 # Call this function to convert the file into the upload formatted version for Transifex
 def process_as_download(file_content, is_plurals):
     return map_to_content(content_to_map(file_content, False, is_plurals), is_plurals)
@@ -905,27 +1737,44 @@ def process_as_download(file_content, is_plurals):
 def process_as_upload(file_content, is_plurals):
     return map_to_content(content_to_map(file_content, True, is_plurals), is_plurals)
 
-# Call this function to update the string tags for a resource.
+# Call this function to update the string tags and instructions for a resource. Strings are sent in bulk batches of BULK_SIZE and a batch
+# rejected by the bulk endpoint is sent again one string per request in parallel. Returns the number of strings updated
 def update_string_meta(to_lock, string_instructions):
+    strings = []
     for key in to_lock:
-        payload = {
-            "data": {
-                "attributes": {
-                    "tags": to_lock[key]
-                },
-                "id": key,
-                "type": "resource_strings"
-            }
+        string = {
+            "attributes": {
+                "tags": to_lock[key]
+            },
+            "id": key,
+            "type": "resource_strings"
         }
         if key in string_instructions and string_instructions[key]:
-            payload["data"]["attributes"]["instructions"] = string_instructions[key].strip()
-        response = do_request(BASE_URL + "/resource_strings/" + key, payload, "PATCH")
+            string["attributes"]["instructions"] = string_instructions[key].strip()
+        strings.append(string)
+    updated = 0
+    for i in range(0, len(strings), BULK_SIZE):
+        batch = strings[i:i + BULK_SIZE]
+        response = do_request(BASE_URL + "/resource_strings", {"data": batch}, "PATCH", None, BULK_CONTENT_TYPE)
         if "errors" in response:
             print_error(response["errors"])
+            print("WARN: Bulk update was rejected. Updating " + str(len(batch)) + " strings individually")
+            updated += run_pool(update_single_string_meta, batch).count(True)
+        else:
+            updated += len(batch)
+    return updated
 
-# Call this function to create a string comment after the strings developer comments have been updated
+# Call this function to update the tags and instructions of a single string
+def update_single_string_meta(string):
+    response = do_request(BASE_URL + "/resource_strings/" + string["id"], {"data": string}, "PATCH")
+    if "errors" in response:
+        print_error(response["errors"])
+        return False
+    return True
+
+# Call this function to create a string comment after the strings developer comments have been updated. Returns the number of comments created
 def update_comments(to_comment):
-    for key in to_comment:
+    def create_comment(key):
         payload  = {
             "data": {
                 "attributes": {
@@ -952,18 +1801,39 @@ def update_comments(to_comment):
         response = do_request(BASE_URL + "/resource_string_comments", payload)
         if "errors" in response:
             print_error(response["errors"])
+            return False
+        return True
+    return run_pool(create_comment, list(to_comment)).count(True)
 
 # Call this function to merge resource_content and branch_content into one file
 def merge_strings(resource_content, branch_content, upload, is_plurals, merge_different_langs = False):
     full_map = content_to_map(resource_content, upload, is_plurals)
     part_map = content_to_map(branch_content, upload, is_plurals)
+    return map_to_content(merge_maps(full_map, part_map, is_plurals, merge_different_langs), is_plurals)
+
+# Call this function to return a new strings mapping with the strings of part_map added to or replacing those of full_map.
+# When merging different languages, empty strings of part_map are skipped so the full_map string is kept.
+# When counts is given, the keys of part_map that were added, overridden with a different string or already equal are added to it
+def merge_maps(full_map, part_map, is_plurals, merge_different_langs = False, counts = None):
+    merged = dict(full_map)
+    added = 0
+    overridden = 0
+    unchanged = 0
     for key in part_map:
-        if merge_different_langs:
-            if is_plurals or len(part_map[key]["s"].strip()) > 0:
-                full_map[key] = part_map[key]
+        if merge_different_langs and not is_plurals and len(part_map[key]["s"].strip()) == 0:
+            continue
+        if key not in merged:
+            added += 1
+        elif merged[key] != part_map[key]:
+            overridden += 1
         else:
-            full_map[key] = part_map[key]
-    return map_to_content(full_map, is_plurals)
+            unchanged += 1
+        merged[key] = part_map[key]
+    if counts != None:
+        counts["added"] += added
+        counts["overridden"] += overridden
+        counts["unchanged"] += unchanged
+    return merged
 
 # Call this function to check if a string mapping is equivalent to another
 def strings_equal(string_a, string_b, is_plurals = False):
@@ -982,100 +1852,474 @@ def strings_equal(string_a, string_b, is_plurals = False):
             return False
     return True
 
-# Call this function to return the children of the parent as pure XML
-def subnodes_as_text(parent):
-    node_value = ""
-    for node in parent.childNodes:
-        node_value = node_value + node.toxml()
-    return node_value
-
-# Call this function to convert a plist xml node to a plural string mapping
-def get_plural_data(node, upload):
-    map = {
-        "var": subnodes_as_text(node.getElementsByTagName('string')[0]),
-        "ctx": subnodes_as_text(node.getElementsByTagName('key')[1]),
-        "str": {}
-    }
-    i = 0
-    key = ""
-    skip = 2
-    data_dict = node.getElementsByTagName('dict')[0]
-    while i < len(data_dict.childNodes):
-        child = data_dict.childNodes[i]
-        if child.nodeType == child.ELEMENT_NODE:
-            if skip > 0:
-                skip -= 1
-            else:
-                if child.tagName == "key":
-                    key = subnodes_as_text(child)
-                elif child.tagName == "string":
-                    map["str"][key] = replace_characters(subnodes_as_text(child), upload)
-        i += 1
+# Call this function to escape text and attribute values the same way as the DOM serializer
+def escape_xml(data):
+    return data.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+# Call this function to read a stringsdict file, given as a string or an iterable of text chunks, and yield each (key, plural string mapping)
+# pair as soon as its entry has been parsed. The children of the key and string nodes are kept as pure XML.
+# With upload set to None the plural strings are kept as written in the file. Raises ExpatError for malformed XML and IndexError for incomplete entries
+def iter_stringsdict(file_content, upload):
+    parser = ParserCreate()
+    parser.buffer_text = True
+    parsed = []
+    out = [] # Serialized XML of the current top level node of the root dict
+    stack = [] # Open nodes as [tag, callbacks, start index in out, has children]
+    state = {"root": None, "done": False, "key": "", "entry": None, "cdata": False, "cdata_open": False}
+
+    def in_root():
+        return state["root"] != None and not state["done"] and len(stack) > state["root"]
+
+    def child_event():
+        node = stack[-1]
+        if not node[3]:
+            node[3] = True
+            out.append(">")
+
+    def set_string_key(value):
+        state["key"] = value
+
+    def set_entry_value(name):
+        def callback(value):
+            state["entry"][name] = value
+        return callback
+
+    def set_plural_key(value):
+        state["entry"]["plural_key"] = sys.intern(value)
+
+    def set_plural_string(value):
+        entry = state["entry"]
+        entry["str"][entry["plural_key"]] = value if upload == None else replace_characters(value, upload)
+
+    def finish_entry(value):
+        entry = state["entry"]
+        state["entry"] = None
+        if entry["var"] == None or entry["ctx"] == None or entry["data"] == None:
+            raise IndexError("Incomplete plural string entry for key " + state["key"])
+        parsed.append((sys.intern(state["key"]), PluralEntry(sys.intern(entry["var"]), sys.intern(entry["ctx"]), entry["str"])))
+
+    def start_element(name, attrs):
+        level = len(stack)
+        if state["root"] == None:
+            if name == "dict":
+                state["root"] = level
+            stack.append([name, [], 0, True])
+            return
+        if not in_root():
+            stack.append([name, [], 0, True])
+            return
+        child_event()
+        out.append("<" + name)
+        for attr in attrs:
+            out.append(" " + attr + "=\"" + escape_xml(attrs[attr]) + "\"")
+        callbacks = []
+        entry = state["entry"]
+        if level == state["root"] + 1:
+            if name == "key":
+                callbacks.append(set_string_key)
+            elif name == "dict":
+                state["entry"] = {"var": None, "ctx": None, "str": {}, "strings": 0, "keys": 0, "data": None, "closed": False, "children": 0, "plural_key": ""}
+                callbacks.append(finish_entry)
+        elif entry != None:
+            if entry["data"] != None and not entry["closed"] and level == entry["data"] + 1:
+                entry["children"] += 1
+                if entry["children"] > 2: # Skip NSStringFormatSpecTypeKey and its value
+                    if name == "key":
+                        callbacks.append(set_plural_key)
+                    elif name == "string":
+                        callbacks.append(set_plural_string)
+            if name == "string":
+                entry["strings"] += 1
+                if entry["strings"] == 1:
+                    callbacks.append(set_entry_value("var"))
+            elif name == "key":
+                entry["keys"] += 1
+                if entry["keys"] == 2:
+                    callbacks.append(set_entry_value("ctx"))
+            elif name == "dict" and entry["data"] == None:
+                entry["data"] = level
+                callbacks.append(close_data_dict)
+        stack.append([name, callbacks, len(out), False])
+
+    def close_data_dict(value):
+        state["entry"]["closed"] = True
+
+    def end_element(name):
+        node = stack.pop()
+        level = len(stack)
+        if state["root"] == None or state["done"] or level < state["root"]:
+            return
+        if level == state["root"]:
+            state["done"] = True
+            return
+        if node[3]:
+            value = "".join(out[node[2] + 1:])
+            out.append("</" + name + ">")
+        else:
+            value = ""
+            out.append("/>")
+        for callback in node[1]:
+            callback(value)
+        if level == state["root"] + 1:
+            del out[:]
+
+    def character_data(data):
+        if not in_root():
+            return
+        child_event()
+        if state["cdata"]:
+            if not state["cdata_open"]:
+                state["cdata_open"] = True
+                out.append("<![CDATA[")
+            out.append(data)
+        else:
+            out.append(escape_xml(data))
+
+    def start_cdata():
+        state["cdata"] = True
+        state["cdata_open"] = False
+
+    def end_cdata():
+        if state["cdata_open"]:
+            out.append("]]>")
+        state["cdata"] = False
+        state["cdata_open"] = False
+
+    def comment(data):
+        if in_root():
+            child_event()
+            out.append("<!--" + data + "-->")
+
+    def processing_instruction(target, data):
+        if in_root():
+            child_event()
+            out.append("<?" + target + " " + data + "?>")
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.StartCdataSectionHandler = start_cdata
+    parser.EndCdataSectionHandler = end_cdata
+    parser.CommentHandler = comment
+    parser.ProcessingInstructionHandler = processing_instruction
+
+    if isinstance(file_content, str):
+        file_content = [file_content[i:i + STRINGSDICT_CHUNK_SIZE] for i in range(0, len(file_content), STRINGSDICT_CHUNK_SIZE)]
+    for chunk in file_content:
+        parser.Parse(chunk, False)
+        for item in parsed:
+            yield item
+        del parsed[:]
+    parser.Parse("", True)
+    for item in parsed:
+        yield item
+    if state["root"] == None:
+        raise IndexError("No root dict found in stringsdict file")
+
+# Base of the entries of a strings mapping. An entry keeps its fields in slots instead of a dict per key, and can still be read and
+# updated by field name like the dict it replaces
+class MapEntry(object):
+    __slots__ = ()
+
+    def __getitem__(self, name):
+        if name in self.__slots__:
+            return getattr(self, name)
+        raise KeyError(name)
+
+    def __setitem__(self, name, value):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in self.__slots__
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def values(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.__slots__]
+
+    def get(self, name, default = None):
+        return getattr(self, name) if name in self.__slots__ else default
+
+    def __eq__(self, other):
+        if type(other) is type(self):
+            return self.values() == other.values()
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+# A string of a strings file: the developer comment and the string
+class StringEntry(MapEntry):
+    __slots__ = ("c", "s")
+
+    def __init__(self, c, s):
+        self.c = c
+        self.s = s
+
+    def __eq__(self, other):
+        if type(other) is StringEntry:
+            return self.s == other.s and self.c == other.c
+        return MapEntry.__eq__(self, other)
+
+    def __ne__(self, other):
+        if type(other) is StringEntry:
+            return self.s != other.s or self.c != other.c
+        return MapEntry.__ne__(self, other)
+
+# A plural string of a stringsdict file: the format, the variable name and the strings by plural rule
+class PluralEntry(MapEntry):
+    __slots__ = ("var", "ctx", "str")
+
+    def __init__(self, var, ctx, str):
+        self.var = var
+        self.ctx = ctx
+        self.str = str
+
+# Call this function to return the JSON value of a strings mapping entry, the list of its fields
+def map_entry_to_json(entry):
+    if isinstance(entry, MapEntry):
+        return entry.values()
+    raise TypeError("Object of type " + type(entry).__name__ + " is not JSON serializable")
+
+# Call this function to return the strings mapping entry of its JSON value. Keys and comments are interned like when parsing
+def map_entry_from_json(value):
+    if len(value) == 2:
+        return StringEntry(sys.intern(value[0]), value[1])
+    return PluralEntry(sys.intern(value[0]), sys.intern(value[1]), value[2])
+
+# Call this function to convert a strings file to a strings mapping, reusing a previously parsed mapping of the same content when cached
+def content_to_map(file_content, upload, is_plurals = False):
+    cache_key = map_cache_key(file_content, upload, is_plurals)
+    map = map_cache_get(cache_key)
+    if map == None:
+        map = parse_content_to_map(file_content, upload, is_plurals)
+        map_cache_put(cache_key, map)
     return map
 
-# Call this function to convert a strings file to a strings mapping
-def content_to_map(file_content, upload, is_plurals = False):
+# Call this function to return the cache key of a parsed strings mapping for the given content and parse options
+def map_cache_key(file_content, upload, is_plurals):
+    return map_cache_digest_key(hashlib.sha256(file_content.encode("utf-8")).hexdigest(), upload, is_plurals)
+
+# Call this function to return the cache key of a parsed strings mapping from the sha256 hex digest of the UTF-8 encoded content
+def map_cache_digest_key(digest, upload, is_plurals):
+    return digest + "-" + ("u" if upload else "d") + ("p" if is_plurals else "s") + MAP_CACHE_VERSION
+
+# Call this function to load a parsed strings mapping from the on-disk cache. Returns None on a miss
+def map_cache_get(cache_key):
+    global map_cache_enabled
+    if not map_cache_enabled:
+        return None
+    path = MAP_CACHE_FOLDER + cache_key + ".json"
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            map = {sys.intern(key): map_entry_from_json(value) for key, value in json.load(file).items()}
+        os.utime(path) # Mark the entry as recently used for the LRU eviction
+    except (OSError, ValueError):
+        map = None
+    with map_cache_lock:
+        map_cache_stats["misses" if map == None else "hits"] += 1
+    return map
+
+# Call this function to store a parsed strings mapping in the on-disk cache and evict the least recently used entries above the size limit
+def map_cache_put(cache_key, map):
+    global map_cache_enabled
+    if not map_cache_enabled:
+        return
+    path = MAP_CACHE_FOLDER + cache_key + ".json"
+    tmp_path = temp_path(path)
+    try:
+        if not os.path.isdir(MAP_CACHE_FOLDER):
+            os.makedirs(MAP_CACHE_FOLDER, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(map, file, ensure_ascii=False, separators=(",", ":"), default=map_entry_to_json)
+        os.replace(tmp_path, path)
+    except OSError as ex:
+        print("WARN: Unable to write the strings cache, disabling it: " + str(ex))
+        remove_temp_file(tmp_path)
+        map_cache_enabled = False
+        return
+    with map_cache_lock:
+        entries = []
+        total_size = 0
+        for name in os.listdir(MAP_CACHE_FOLDER):
+            if not name.endswith(".json"):
+                continue
+            try:
+                stat = os.stat(MAP_CACHE_FOLDER + name)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total_size += stat.st_size
+        entries.sort()
+        limit = map_cache_size * 1024 * 1024
+        while total_size > limit and entries:
+            mtime, size, name = entries.pop(0)
+            try:
+                os.remove(MAP_CACHE_FOLDER + name)
+            except OSError:
+                pass
+            total_size -= size
+            map_cache_stats["evictions"] += 1
+
+# Call this function to print the hit and miss counts of the parsed strings cache
+def print_map_cache_stats():
+    lookups = map_cache_stats["hits"] + map_cache_stats["misses"]
+    rate = 100.0 * map_cache_stats["hits"] / lookups if lookups else 0.0
+    print("Strings cache: {} hits, {} misses ({:.1f}% hit rate), {} evictions".format(map_cache_stats["hits"], map_cache_stats["misses"], rate, map_cache_stats["evictions"]))
+
+# Call this function to parse a strings file into a strings mapping
+def parse_content_to_map(file_content, upload, is_plurals = False):
     map = {}
     if is_plurals:
-        doc = parseString(file_content)
-        root_dict = doc.getElementsByTagName('dict')[0]
-        string_key = ""
-        for node in root_dict.childNodes:
-            if node.nodeType == node.ELEMENT_NODE:
-                if node.tagName == "key":
-                    string_key = subnodes_as_text(node)
-                elif node.tagName == "dict":
-                    map[string_key] = get_plural_data(node, upload)
+        if file_content.strip(): # An empty stringsdict file has no plurals
+            for key, plural in iter_stringsdict(file_content, upload):
+                map[key] = plural
     else:
-        global unicode_regex
-        file_content = re.sub(unicode_regex, '', file_content)
-        lines = file_content.split("\n")
-        i = 0
-        context = ""
-        while i < len(lines):
-            lines[i] = lines[i].strip()
-            if "/*" == lines[i][0:2] and "*/" == lines[i][-2:len(lines[i])]:
-                context = lines[i][2:-2].strip()
-            elif len(lines[i]) >= 6 and lines[i][0] == "\"" and lines[i][-1] == ";":
-                parts = lines[i].split("=", 1)
-                map[parts[0].strip()[1:-1]] = {
-                    'c': context,
-                    's': replace_characters(parts[1].strip()[1:-2], upload)
-                }
-            i += 1
+        map = parse_strings_lines(file_content.split("\n"), upload)
+    return map
+
+# Call this function to convert the lines of a strings file to a strings mapping. The lines can come from any iterable, such as a
+# download that is still being read, and must not include their new line characters
+def parse_strings_lines(lines, upload):
+    map = read_strings_lines(lines)
+    converted = replace_characters_list([map[key].s for key in map], upload)
+    for key, string in zip(map, converted):
+        map[key].s = string
+    return map
+
+# Call this function to tokenize the lines of a strings file in a single pass and return the strings mapping with each string as written
+# in the file. With an errors list given, the file is validated in the same pass and the error of each invalid line is added to it.
+# Lines are numbered from the first line left after trimming the invisible characters from the start of the file.
+# Keys and comments are interned, so every mapping of a resource shares them
+def read_strings_lines(lines, errors = None):
+    map = {}
+    context = ""
+    line_number = 0
+    for line_number, line in enumerate(trim_content_lines(lines), 1):
+        line = line.strip()
+        if "/*" == line[0:2] and "*/" == line[-2:len(line)]:
+            context = sys.intern(line[2:-2].strip())
+        elif len(line) >= 6 and line[0] == "\"" and line[-1] == ";" and "=" in line:
+            parts = line.split("=", 1)
+            key = parts[0].strip()[1:-1]
+            string = parts[1].strip()[1:-2]
+            if errors != None:
+                if len(key) == 0 or len(string) == 0:
+                    errors.append("Invalid string line for line " + str(line_number))
+                elif UNESCAPED_QUOTE_REGEX.search(key) != None or UNESCAPED_QUOTE_REGEX.search(string) != None:
+                    errors.append("Invalid quote escapes on line " + str(line_number))
+            map[sys.intern(key)] = StringEntry(context, string)
+        elif errors != None:
+            errors.append("Invalid comment or string entry on line " + str(line_number))
+    if errors != None and line_number == 0:
+        errors.append("Invalid comment or string entry on line 1") # An empty file is a single empty line
+    return map
+
+# Call this function to yield the lines of a file as if unicode_regex had removed the invisible characters from the start and end of the
+# whole file first. Lines made only of those characters are only yielded when a line with other characters follows them
+def trim_content_lines(lines):
+    leading = True
+    last = None
+    blank = []
+    for line in lines:
+        if leading:
+            line = unicode_leading_regex.sub('', line)
+            if line == "":
+                continue
+            leading = False
+        if unicode_only_regex.fullmatch(line):
+            blank.append(line)
+            continue
+        if last != None:
+            yield last
+        if blank:
+            for item in blank:
+                yield item
+            blank = []
+        last = line
+    if last != None:
+        yield unicode_trailing_regex.sub('', last)
+
+# Call this function to split text chunks into lines on new line characters only, in the same way as str.split("\n")
+def iter_chunk_lines(chunks):
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    yield pending
+
+# Call this function to read a text file in chunks of the given size
+def iter_file_chunks(file_path, chunk_size = STREAM_CHUNK_SIZE):
+    with open(file_path, "r", encoding="utf-8", newline="") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+# Call this function to convert a downloaded strings file to a strings mapping without reading the whole file into memory
+def parse_file_to_map(file_path, upload, is_plurals = False):
+    map = {}
+    if is_plurals:
+        for key, plural in iter_stringsdict(iter_file_chunks(file_path, STRINGSDICT_CHUNK_SIZE), upload):
+            map[key] = plural
+    else:
+        map = parse_strings_lines(iter_chunk_lines(iter_file_chunks(file_path)), upload)
     return map
 
 # Call this function to convert a strings mapping to a strings file
 def map_to_content(map, is_plurals = False):
-    file = ""
+    stream = io.StringIO()
+    write_content(stream, map, is_plurals)
+    return stream.getvalue()
+
+# Call this function to write a strings mapping as a strings file to the given text stream.
+# Stringsdict nodes are written with 2 spaces per nesting level, no trailing new line is written
+def write_content(stream, map, is_plurals = False):
+    write = stream.write
     if is_plurals:
-        file = []
-        file.append("<?xml version=\"1.0\" encoding=\"UTF-8\"?>")
-        file.append("<!DOCTYPE plist PUBLIC \"-//Apple//DTD PLIST 1.0//EN\" \"http://www.apple.com/DTDs/PropertyList-1.0.dtd\">")
-        file.append("<plist version=\"1.0\">")
-        file.append("<dict>")
+        write(PLIST_HEADER)
         for key in map:
-            file.append(tagify("key", key))
-            file.append("<dict>")
-            file.append(tagify("key", "NSStringLocalizedFormatKey"))
-            file.append(tagify("string", map[key]["var"]))
-            file.append(tagify("key", map[key]["ctx"]))
-            file.append("<dict>")
-            file.append(tagify("key", "NSStringFormatSpecTypeKey"))
-            file.append(tagify("string", "NSStringPluralRuleType"))
-            for sub_key in map[key]["str"]:
-                file.append(tagify("key", sub_key))
-                file.append(tagify("string", map[key]["str"][sub_key]))
-            file.append("</dict>")
-            file.append("</dict>")
-        file.append("</dict>")
-        file.append("</plist>")
-        return indent_xml(file)
+            plural = map[key]
+            write("\n    " + tagify("key", key) +
+                  "\n    <dict>" +
+                  "\n      <key>NSStringLocalizedFormatKey</key>" +
+                  "\n      " + tagify("string", plural["var"]) +
+                  "\n      " + tagify("key", plural["ctx"]) +
+                  "\n      <dict>" +
+                  "\n        <key>NSStringFormatSpecTypeKey</key>" +
+                  "\n        <string>NSStringPluralRuleType</string>")
+            for sub_key in plural["str"]:
+                write("\n        " + tagify("key", sub_key) + "\n        " + tagify("string", plural["str"][sub_key]))
+            write("\n      </dict>\n    </dict>")
+        write("\n  </dict>\n</plist>")
     else:
+        separator = ""
         for key in map:
-            file += "/* " + map[key]["c"] + " */\n"
-            file += "\"" + key + "\"=\"" + map[key]["s"] + "\";\n"
-    return file.strip()
+            write(separator + "/* " + map[key]["c"] + " */\n\"" + key + "\"=\"" + map[key]["s"] + "\";")
+            separator = "\n"
 
 # Call this function to return a string of the given xml tag with the value
 def tagify(tag, value):
@@ -1083,165 +2327,227 @@ def tagify(tag, value):
 
 # Call this function to check if the upload content is valid
 def validate_file(file_content, is_plurals = False):
-    valid = True
+    return read_upload_file(file_content, is_plurals) != None
+
+# Call this function to parse and validate a file to upload in a single pass, printing each error found. Returns the strings mapping of
+# the file with the strings kept as written in the file, or None when the file is invalid
+def read_upload_file(file_content, is_plurals = False):
     if is_plurals:
         try:
-            parseString(file_content)
-        except ExpatError as ex:
+            return dict(iter_stringsdict(file_content, None))
+        except (ExpatError, IndexError) as ex:
             print("Error: Failed to parse stringsdict file: " + str(ex))
-            valid = False
-        return valid
-    global unicode_regex
-    file_content = re.sub(unicode_regex, '', file_content)
-    lines = file_content.split("\n")
-    i = 0
-    while i < len(lines):
-        lines[i] = lines[i].strip()
-        if "/*" == lines[i][0:2] and "*/" == lines[i][-2:len(lines[i])]:
-            i = i # No-op. Valid comment
-        elif len(lines[i]) >= 6 and lines[i][0] == "\"" and lines[i][-1] == ";":
-            parts = lines[i].split("=", 1)
-            key = parts[0].strip()[1:-1]
-            string = parts[1].strip()[1:-2]
-            if len(key) > 0 and len(string) > 0:
-                key_matches = re.search('(?<!\\\\)(?:\\\\{2})*"', key)
-                string_matches = re.search('(?<!\\\\)(?:\\\\{2})*"', string)
-                if key_matches != None or string_matches != None:
-                    print("Error: Invalid quote escapes on line " + str(i + 1))
-                    valid = False
-            else:
-                print("Error: Invalid string line for line " + str(i + 1))
-                valid = False
-        else:
-            print("Error: Invalid comment or string entry on line " + str(i + 1))
-            valid = False
-        i += 1
-    return valid
+            return None
+    errors = []
+    map = read_strings_lines(file_content.split("\n"), errors)
+    for error in errors:
+        print("Error: " + error)
+    return None if errors else map
+
+# Call this function to return a copy of a strings mapping with the characters of every string replaced for upload or download
+def convert_map(map, upload, is_plurals = False):
+    if is_plurals:
+        return {key: PluralEntry(map[key]["var"], map[key]["ctx"], {plural_key: replace_characters(string, upload) for plural_key, string in map[key]["str"].items()}) for key in map}
+    converted = replace_characters_list([map[key]['s'] for key in map], upload)
+    return {key: StringEntry(map[key]['c'], string) for key, string in zip(map, converted)}
 
 # Call this function to replace characters in a node/string with the correct version
 def replace_characters(string, upload):
-    replace = [
-        r"'''",                                                # A. Triple prime
-        r'(\W|^)"(\w)',                                        # B. Beginning double quote
-        r'(“[^"]*)"([^"]*$|[^“"]*“)',                          # C. Ending double quote
-        r'([^0-9])"',                                          # D. Remaining double quote at the end of word
-        r"''",                                                 # E. Double prime as two single quotes
-        r"(\W|^)'(\S)",                                        # F. Beginning single quote
-        r"([A-z0-9])'([A-z])",                                 # G. Conjunction's possession
-        r"(‘)([0-9]{2}[^’]*)(‘([^0-9]|$)|$|’[A-z])",           # H. Abbreviated years like '93
-        r"((‘[^']*)|[A-z])'([^0-9]|$)",                        # I. Ending single quote
-        r"(\B|^)‘(?=([^‘’]*’\b)*([^‘’]*\B\W[‘’]\b|[^‘’]*$))",  # J. Backwards apostrophe
-        r'"',                                                  # K. Double prime
-        r"'",                                                  # L. Prime
-        r"\.\.\."                                              # M. Ellipsis
-    ]
-    replace_to = [
-        r'‴',        # A
-        r'\1“\2',    # B
-        r'\1”\2',    # C
-        r'\1”',      # D
-        r'″',        # E
-        r"\1‘\2",    # F
-        r"\1’\2",    # G
-        r"’\2\3",    # H
-        r"\1’\3",    # I
-        r"\1’",      # J
-        r"″",        # K
-        r"′",        # L
-        r"…"         # M
-    ]
     global xml_tag_regex
-    tags = xml_tag_regex.findall(string)
-    for i in range(len(tags)):
-        string = string.replace(tags[i], " <t " + str(i) + "> ")
+    if "<" in string:
+        tags = xml_tag_regex.findall(string)
+        for i in range(len(tags)):
+            string = string.replace(tags[i], " <t " + str(i) + "> ")
+    else:
+        tags = []
     if upload:
-        string = string.replace("\r\n", "[Br]")
-        string = string.replace("\r", "[Br]")
-        string = string.replace("\n", "[Br]")
-        string = string.replace(r"\r\n", "[Br]")
-        string = string.replace(r"\r", "[Br]")
-        string = string.replace(r"\n", "[Br]")
-        string = string.replace("\\", "")
-        for i in range(len(replace)):
-            string = re.sub(replace[i], replace_to[i], string)
+        if "\r" in string or "\n" in string or "\\" in string:
+            string = string.replace("\r\n", "[Br]")
+            string = string.replace("\r", "[Br]")
+            string = string.replace("\n", "[Br]")
+            string = string.replace(r"\r\n", "[Br]")
+            string = string.replace(r"\r", "[Br]")
+            string = string.replace(r"\n", "[Br]")
+            string = string.replace("\\", "")
+        for regex, replace_to, trigger in UPLOAD_REPLACEMENTS:
+            if trigger in string:
+                string = regex.sub(replace_to, string)
     else:
-        string = re.sub(replace[12], replace_to[12], string)
-        string = string.replace("[x]", "[X]")
-        string = string.replace("[a]", "[A]")
-        string = string.replace("[/a]", "[/A]")
-        string = string.replace("[b]", "[B]")
-        string = string.replace("[/b]", "[/B]")
-        string = string.replace("[a1]", "[A1]")
-        string = string.replace("[/a1]", "[/A2]")
-        string = string.replace("[a2]", "[A2]")
-        string = string.replace("[/a2]", "[/A2]")
-        string = string.replace("[x1]", "[X1]")
-        string = string.replace("[/x1]", "[/X1]")
-        string = string.replace("[x2]", "[X2]")
-        string = string.replace("[/x2]", "[/X2]")
-        string = string.replace("\n", "")
-        string = string.replace("\r", "")
-        string = string.replace("[Br]", r"\n")
+        if "..." in string:
+            string = ELLIPSIS_REGEX.sub("…", string)
+        if "[" in string:
+            string = DOWNLOAD_TAG_REGEX.sub(lambda match: DOWNLOAD_TAGS[match.group(0)], string)
+        if "\n" in string or "\r" in string:
+            string = string.replace("\n", "")
+            string = string.replace("\r", "")
+        if "[Br]" in string:
+            string = string.replace("[Br]", r"\n")
 
     for i in range(len(tags)):
         string = string.replace(" <t " + str(i) + "> ", tags[i])
     return string
 
+# Call this function to replace characters in all the strings of a resource at once. Repeated strings are only converted once
+def replace_characters_list(strings, upload):
+    converted = {}
+    result = []
+    for string in strings:
+        if string not in converted:
+            converted[string] = replace_characters(string, upload)
+        result.append(converted[string])
+    return result
+
 # Call this function to correctly indent an XML string array with 2 spaces per indent
 def indent_xml(lines):
-    result = ""
+    result = []
     padding = 0
-    for i in range(len(lines)):
-        token = lines[i].lstrip()
-        matches = re.search(r'.+<\/\w[^>]*>$', token)
-        if matches == None:
-            matches = re.search(r'^<\/\w', token)
-            if matches == None:
-                matches = re.search(r'^<\w[^>]*[^\/]>.*$', token)
-                if matches == None:
-                    indent = 0
-                else:
-                    indent = 2
-            else:
+    for line in lines:
+        token = line.lstrip()
+        indent = 0
+        if INDENT_CLOSED_REGEX.search(token) == None:
+            if INDENT_CLOSE_REGEX.search(token) != None:
                 padding -= 2
-                indent = 0
-        else:
-            indent = 0
-        line = token.rjust(len(token) + padding, ' ')
-        result = result + line + "\n"
+            elif INDENT_OPEN_REGEX.search(token) != None:
+                indent = 2
+        result.append(" " * max(padding, 0) + token)
         padding += indent
-    return result.strip()
+    return "\n".join(result).strip()
 
-# Call this function to store a resource file in the correct directory
-def store_file(resource, content, lang = "Base"):
+# Call this function to return the path a resource file is stored at for the given language
+def get_store_path(resource, lang = "Base"):
     if lang in REMAPPED_CODE:
         lang = REMAPPED_CODE[lang]
     if resource in RESERVED_RESOURCES:
-        file_path = get_reserved_resource_path(resource) + lang + ".lproj/" + get_file_basename(resource)
+        return get_reserved_resource_path(resource) + lang + ".lproj/" + get_file_basename(resource)
     elif "Changelogs" in resource:
-        file_path = DOWNLOAD_FOLDER + "Changelogs.strings-" + lang
-    else:
-        file_path = PROD_FOLDER + lang + ".lproj/" + get_file_basename(resource)
-    print("Saving file " + file_path)
-    file_put_contents(file_path, content)
-    if lang == "Base" and ("Localizable" in resource or "InfoPlist" in resource or "Plurals" in resource):
-        file_put_contents(file_path.replace("Base", "en"), content)
+        return DOWNLOAD_FOLDER + "Changelogs.strings-" + lang
+    return PROD_FOLDER + lang + ".lproj/" + get_file_basename(resource)
+
+# Call this function to check if the Base version of a resource is also stored as the English version
+def stores_english_copy(resource, lang):
+    if lang in REMAPPED_CODE:
+        lang = REMAPPED_CODE[lang]
+    return lang == "Base" and ("Localizable" in resource or "InfoPlist" in resource or "Plurals" in resource)
 
-# Wrapper to write content to file
+# Call this function to store a strings mapping as a resource file in the correct directory, writing it straight to the file
+def store_map(resource, map, is_plurals, lang = "Base"):
+    tmp_path = temp_path(get_store_path(resource, lang))
+    try:
+        with open(tmp_path, "w") as file:
+            write_content(file, map, is_plurals)
+    except:
+        remove_temp_file(tmp_path)
+        raise
+    store_written_file(resource, tmp_path, lang)
+
+# Call this function to move a strings file written to the temporary path of the resource language file in place
+def store_written_file(resource, tmp_path, lang = "Base"):
+    file_path = get_store_path(resource, lang)
+    written = replace_if_changed(tmp_path, file_path)
+    print(("Saving file " if written else "Unchanged file ") + file_path)
+    count_stored_file(written)
+    if stores_english_copy(resource, lang):
+        count_stored_file(copy_if_changed(file_path, file_path.replace("Base", "en")))
+
+# Wrapper to write content to file. The file is replaced atomically and left untouched when the content is unchanged
 def file_put_contents(filepath, content):
-    with open(filepath, "w") as file:
-        return file.write(content) > 0
+    tmp_path = temp_path(filepath)
+    try:
+        with open(tmp_path, "w") as file:
+            file.write(content)
+    except:
+        remove_temp_file(tmp_path)
+        raise
+    replace_if_changed(tmp_path, filepath)
+    return len(content) > 0
+
+# Call this function to return a temporary file path next to the file path, unique to the current process and thread
+def temp_path(filepath):
+    return filepath + "." + str(os.getpid()) + "-" + str(get_ident()) + ".tmp"
+
+# Call this function to move the temporary file over the file path unless the file already has the same content. Returns True if the file was written
+# The replaced file keeps its permissions
+def replace_if_changed(tmp_path, filepath):
+    try:
+        if os.path.isfile(filepath):
+            if filecmp.cmp(tmp_path, filepath, shallow=False):
+                os.remove(tmp_path)
+                return False
+            shutil.copymode(filepath, tmp_path)
+        os.replace(tmp_path, filepath)
+    except:
+        remove_temp_file(tmp_path)
+        raise
+    return True
+
+# Call this function to copy the file to the destination unless the destination already has the same content. Returns True if the file was written
+def copy_if_changed(filepath, destination):
+    if os.path.isfile(destination) and filecmp.cmp(filepath, destination, shallow=False):
+        return False
+    tmp_path = temp_path(destination)
+    try:
+        shutil.copyfile(filepath, tmp_path)
+        if os.path.isfile(destination):
+            shutil.copymode(destination, tmp_path)
+        os.replace(tmp_path, destination)
+    except:
+        remove_temp_file(tmp_path)
+        raise
+    return True
+
+# Call this function to remove a temporary file left by a failed write, if it was created
+def remove_temp_file(tmp_path):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+# Call this function to count a stored resource file as written or skipped because it was unchanged
+def count_stored_file(written):
+    with store_lock:
+        store_stats["written" if written else "skipped"] += 1
+
+# Call this function to print how many resource files were written and how many were unchanged
+def print_store_summary():
+    if store_stats["written"] + store_stats["skipped"] > 0:
+        print("Files: {} written, {} unchanged".format(store_stats["written"], store_stats["skipped"]))
 
 # Call this function to return a resource name based on the current git branch
 def get_branch_name():
-    global git_path
-    cur_path = os.getcwd()
-    os.chdir(git_path)
-    branch_name = subprocess.check_output(['git', 'symbolic-ref', '--short', '-q', 'HEAD'], universal_newlines=True).strip()
-    os.chdir(cur_path)
-    if branch_name in ["master", "develop", "main"]:
-        return False
-    return re.sub('[^A-Za-z0-9]+', '', branch_name)
+    global branch_name_cache
+    if branch_name_cache == None:
+        branch_name = read_head_branch()
+        if branch_name == None:
+            branch_name = subprocess.check_output(['git', 'symbolic-ref', '--short', '-q', 'HEAD'], cwd=git_path, universal_newlines=True).strip()
+        if branch_name in ["master", "develop", "main", ""]:
+            branch_name_cache = False
+        else:
+            branch_name_cache = re.sub('[^A-Za-z0-9]+', '', branch_name)
+    return branch_name_cache
+
+# Call this function to read the checked out branch from the HEAD file of the repository containing git_path. Returns "" for a detached HEAD
+# and None when the repository cannot be found
+def read_head_branch():
+    path = os.path.abspath(git_path)
+    while not os.path.exists(os.path.join(path, ".git")):
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+    git_dir = os.path.join(path, ".git")
+    try:
+        if os.path.isfile(git_dir):
+            # Worktrees and submodules point to the real git directory
+            gitdir = file_get_contents(git_dir).strip()
+            if not gitdir.startswith("gitdir:"):
+                return None
+            git_dir = os.path.join(path, gitdir[len("gitdir:"):].strip())
+        head = file_get_contents(os.path.join(git_dir, "HEAD")).strip()
+    except OSError:
+        return None
+    if head.startswith("ref: refs/heads/"):
+        return head[len("ref: refs/heads/"):]
+    return ""
 
 # Call this function to return the general file name for the given resource
 def get_file_basename(resource):
@@ -1284,10 +2590,7 @@ def run_download_stores(resource = "ios"):
     #   resource = STORES_ABC_ID
     else:
         resource = STORES_IOS_ID
-    content = resource_get_english(resource, True) # Not a plurals resource but is not UTF-16 encoded
-    if content:
-        file_put_contents(file_name, content)
-    else:
+    if not resource_get_english(resource, True, file_name): # Not a plurals resource but is not UTF-16 encoded
         print("Error: Failed to retrieve stores strings")
     return False
 
@@ -1350,7 +2653,38 @@ def main():
     parser.add_argument("-j", "--jira", nargs=1, help="The JIRA ticket id for the current branch e.g: IOS-1234")
     parser.add_argument("-s", "--startPath", nargs=1, help="The start path in the repository where the strings files will be stored. e.g: /feature/")
     parser.add_argument("-l", "--library", nargs=1, help="The specific library to interact with. Only should be used in the library project. e.g: -l auth = Localizable_auth_lib")
+    parser.add_argument("-i", "--incremental", help="Only export the resource languages updated in Transifex since the last incremental export", action="store_true")
+    parser.add_argument("-w", "--workers", nargs=1, help="The maximum number of resource languages to export at the same time. Defaults to " + str(export_workers), type=int)
+    parser.add_argument("--cpuWorkers", nargs=1, help="The number of processes converting the downloaded languages during export. Defaults to 1, which converts them in the download threads", type=int)
+    parser.add_argument("--noCache", help="Parse every strings file and request all metadata and Gitlab files again instead of using the local caches", action="store_true")
+    parser.add_argument("--cacheTtl", nargs=1, help="Seconds cached Transifex metadata and Gitlab files are used without revalidating them. Defaults to 0", type=int)
+    parser.add_argument("--cacheStats", help="Print the parsed strings and HTTP cache hit and miss counts when finished", action="store_true")
+    parser.add_argument("--localGit", help="Read the Gitlab files from origin/<gitDefaultBranch> in the local clone, only downloading them when that branch is not found", action="store_true")
+    parser.add_argument("--connectionStats", help="Print how many requests reused a pooled connection when finished", action="store_true")
+    parser.add_argument("--stats", nargs="?", help="Print the requests, latency, bytes, retries and poll sleeps of each endpoint when finished. Also writes them to the given JSON file", const=True, default=False)
     args = parser.parse_args()
+    started = time.time()
+    load_config()
+
+    if args.workers:
+        set_export_workers(args.workers[0])
+
+    if args.cpuWorkers:
+        set_cpu_workers(args.cpuWorkers[0])
+
+    if args.noCache:
+        global map_cache_enabled
+        global http_cache_enabled
+        map_cache_enabled = False
+        http_cache_enabled = False
+
+    if args.cacheTtl:
+        global http_cache_ttl
+        http_cache_ttl = args.cacheTtl[0]
+
+    if args.localGit:
+        global local_git_enabled
+        local_git_enabled = True
 
     global PROD_FOLDER
     if args.startPath:
@@ -1463,11 +2797,15 @@ def main():
         elif mode == "fetch":
             run_fetch()
         elif mode == "export":
-            run_export(args.branch)
+            if args.incremental and args.branch:
+                print("WARN: Incremental export is not supported for branches. Exporting everything")
+            prefetch_project_data()
+            run_export(args.branch, False, args.incremental)
         elif mode == "lang":
             resource = "Localizable"
             if args.resource:
                 resource = args.resource[0]
+            prefetch_project_data()
             run_export(True, resource)
         elif mode == "comment":
             if args.resource:
@@ -1534,9 +2872,20 @@ def main():
             print("Error: No resource specified for -r/--resource")
     else:
         print("Error: Invalid script mode.")
+    print_store_summary()
+    if args.cacheStats:
+        print_map_cache_stats()
+        print_http_cache_stats()
+    if args.connectionStats:
+        print_connection_stats()
+    if args.stats:
+        print_http_stats(time.time() - started)
+        if args.stats != True:
+            save_http_stats(args.stats, time.time() - started)
     sys.exit(0)
 
-try:
-    main()
-except KeyboardInterrupt:
-    sys.exit(1)
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
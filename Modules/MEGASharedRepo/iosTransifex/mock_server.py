@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Local stand-in for the Transifex and Gitlab APIs used by iosTransifex.py, serving generated resources so exports, fetches, merges and
+# locks can be run and timed offline. Point the script at it with the TRANSIFEX_BASE_URL and GITLAB_BASE_URL environment variables.
+
+import json, os, sys, time, argparse, random, hashlib, datetime, re
+from threading import Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import iosTransifex as tx
+
+ORGANISATION = "o:meganz-1"
+LANGUAGE_CODES = ["ar", "ca", "cs", "de", "es", "fa", "fr", "he", "hi", "hu", "id", "it", "ja", "ko", "ms", "nl", "pl", "pt", "pt_BR", "ro",
+                  "ru", "sk", "sv", "th", "tl", "tr", "uk", "vi", "zh_CN", "zh_TW"]
+PLURAL_KEYS = ["one", "other"]
+MODIFIED = "2024-01-01T00:00:00Z"
+
+options = None
+project_id = ""
+resources = {}
+languages = {}
+strings = {}
+jobs = {}
+stats = {}
+state_lock = Lock()
+
+# Call this function to return the value of a generated string of a resource in the given language
+def make_value(index, code):
+    value = "String " + str(index) + " with a [a]link[/a], %@ and a[Br]line break..."
+    if code != "en":
+        value = "[" + code + "] " + value
+    return value
+
+# Call this function to return the generated file of a resource in the given language. Strings files are returned in the Transifex form
+# ("key" = "value";) and stringsdict files as a plist
+def make_file(resource, code):
+    is_plurals = "Plurals" in resources[resource]["name"]
+    map = {}
+    for index in range(resources[resource]["strings"]):
+        key = "mock." + resources[resource]["slug"] + "." + str(index)
+        if is_plurals:
+            plural = {}
+            for plural_key in PLURAL_KEYS:
+                plural[plural_key] = "%d " + make_value(index, code) + " (" + plural_key + ")"
+            map[key] = {"var": "%#@count@", "ctx": "count", "str": plural}
+        else:
+            map[key] = {"c": "Comment of string " + str(index), "s": make_value(index, code)}
+    if is_plurals:
+        return tx.map_to_content(map, True)
+    lines = []
+    for key in map:
+        lines.append("/* " + map[key]["c"] + " */\n\"" + key + "\" = \"" + map[key]["s"] + "\";\n")
+    return "".join(lines)
+
+# Call this function to add a resource with the given number of strings
+def add_resource(name, count):
+    slug = name.lower()
+    resource_id = project_id + ":r:" + slug
+    resources[resource_id] = {"name": name, "slug": slug, "strings": count}
+    strings[resource_id] = []
+    for index in range(count):
+        key = "mock." + slug + "." + str(index)
+        strings[resource_id].append({
+            "id": resource_id + ":s:" + hashlib.md5(key.encode("utf-8")).hexdigest(),
+            "key": key,
+            "tags": [],
+            "instructions": None,
+            "modified": MODIFIED
+        })
+    return resource_id
+
+# Call this function to return the JSON:API form of a resource string with only the requested attributes
+def string_data(resource_id, string, fields):
+    attributes = {
+        "key": string["key"],
+        "string_hash": string["id"].split(":s:")[1],
+        "tags": string["tags"],
+        "instructions": string["instructions"],
+        "strings_datetime_modified": string["modified"],
+        "pluralized": "Plurals" in resources[resource_id]["name"],
+        "developer_comment": "Comment of " + string["key"]
+    }
+    if fields:
+        attributes = {name: attributes[name] for name in fields if name in attributes}
+    return {
+        "id": string["id"],
+        "type": "resource_strings",
+        "attributes": attributes,
+        "relationships": {
+            "resource": {"data": {"id": resource_id, "type": "resources"}},
+            "committer": {"data": {"id": "u:mock", "type": "users"}}
+        }
+    }
+
+# Call this function to return one page of items and the url of the next page, if any
+def paginate(handler, items, query):
+    cursor = int(query.get("page[cursor]", 0))
+    page = items[cursor:cursor + options.pageSize]
+    next_url = None
+    if cursor + options.pageSize < len(items):
+        params = [(name, value) for name, value in query.items() if name != "page[cursor]"]
+        params.append(("page[cursor]", str(cursor + options.pageSize)))
+        next_url = handler.base_url() + urlsplit(handler.path).path + "?" + "&".join(name + "=" + value for name, value in params)
+    return page, next_url
+
+# Call this function to count a request for the summary
+def count(name):
+    with state_lock:
+        stats[name] = stats.get(name, 0) + 1
+
+# Call this function to print how many requests of each kind were served
+def print_stats():
+    print("Requests served:")
+    for name in sorted(stats):
+        print("  " + name + ": " + str(stats[name]))
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if options.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def base_url(self):
+        return "http://" + self.headers.get("Host", options.host + ":" + str(options.port))
+
+    def reply(self, code, body = b"", headers = {}):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+            headers = dict(headers)
+            headers.setdefault("Content-Type", "application/vnd.api+json")
+        if code == 200 and self.command == "GET" and body:
+            etag = "\"" + hashlib.sha1(body).hexdigest() + "\""
+            if self.headers.get("If-None-Match") == etag:
+                code = 304
+                body = b""
+            headers = dict(headers)
+            headers["ETag"] = etag
+        self.send_response(code)
+        for name in headers:
+            self.send_header(name, headers[name])
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, code, detail):
+        self.reply(code, {"errors": [{"status": str(code), "code": "error", "detail": detail}]})
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length == 0:
+            return None
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    # Sleeps for the configured latency and answers with a 429 at the configured rate. Returns False when the request was answered
+    def prepare(self, name):
+        count(name)
+        if options.latency or options.jitter:
+            time.sleep((options.latency + random.uniform(0, options.jitter)) / 1000)
+        if name.startswith("gitlab"):
+            if not self.headers.get("PRIVATE-TOKEN"):
+                self.error(401, "Missing Gitlab token")
+                return False
+        elif name != "file" and not self.headers.get("Authorization"):
+            self.error(401, "Missing authorization header")
+            return False
+        if options.rateLimit and name != "file" and random.random() < options.rateLimit:
+            count("429")
+            self.reply(429, {"errors": [{"status": "429", "code": "throttled", "detail": "Too many requests"}]}, {"Retry-After": str(options.retryAfter)})
+            return False
+        return True
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = parts.path
+        query = dict(parse_qsl(parts.query, keep_blank_values=True))
+        if path == "/_stats":
+            with state_lock:
+                return self.reply(200, dict(stats))
+        if path.startswith("/api/v4/projects/"):
+            if self.prepare("gitlab_file"):
+                self.gitlab_file(path)
+            return
+        if path.startswith("/_files/"):
+            if self.prepare("file"):
+                self.job_file(path[len("/_files/"):])
+            return
+        if path == "/resources":
+            if self.prepare("resources"):
+                self.list_resources(query)
+        elif path == "/projects/" + project_id + "/languages":
+            if self.prepare("languages"):
+                self.reply(200, {"data": [{"id": language, "type": "languages", "attributes": {"code": languages[language], "name": languages[language]}} for language in languages]})
+        elif path == "/resource_strings":
+            if self.prepare("resource_strings"):
+                self.list_strings(query)
+        elif path == "/resource_language_stats":
+            if self.prepare("resource_language_stats"):
+                items = []
+                for resource_id in resources:
+                    for language in languages:
+                        items.append({
+                            "id": resource_id + ":" + language,
+                            "type": "resource_language_stats",
+                            "attributes": {"last_update": MODIFIED},
+                            "relationships": {"resource": {"data": {"id": resource_id}}, "language": {"data": {"id": language}}}
+                        })
+                page, next_url = paginate(self, items, query)
+                self.reply(200, {"data": page, "links": {"next": next_url}})
+        elif path.startswith("/users/"):
+            if self.prepare("users"):
+                self.reply(200, {"data": {"id": path[len("/users/"):], "attributes": {"username": "mock"}}})
+        elif re.match(r"^/resource_\w+_async_\w+/[^/]+$", path):
+            if self.prepare("job_status"):
+                self.job_status(path.split("/")[2])
+        else:
+            self.prepare("unknown")
+            self.error(404, "Not found: " + path)
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        payload = self.read_json()
+        if path in ["/resource_strings_async_downloads", "/resource_translations_async_downloads", "/resource_strings_async_uploads"]:
+            if self.prepare("job_create"):
+                self.create_job(path[1:], payload)
+        elif path == "/resources":
+            if self.prepare("resource_create"):
+                name = payload["data"]["attributes"]["name"]
+                with state_lock:
+                    resource_id = add_resource(name, 0)
+                self.reply(201, {"data": {"id": resource_id, "type": "resources", "attributes": {"name": name, "slug": name.lower(), "string_count": 0}}})
+        elif path == "/resource_string_comments":
+            if self.prepare("comment_create"):
+                self.reply(201, {"data": dict(payload["data"], id="comment:" + str(random.getrandbits(32)))})
+        else:
+            self.prepare("unknown")
+            self.error(404, "Not found: " + path)
+
+    def do_PATCH(self):
+        path = urlsplit(self.path).path
+        payload = self.read_json()
+        if path == "/resource_strings":
+            if self.prepare("resource_strings_bulk_patch"):
+                self.reply(200, {"data": [self.update_string(data) for data in payload["data"]]})
+        elif path.startswith("/resource_strings/"):
+            if self.prepare("resource_strings_patch"):
+                self.reply(200, {"data": self.update_string(payload["data"])})
+        else:
+            self.prepare("unknown")
+            self.error(404, "Not found: " + path)
+
+    def list_resources(self, query):
+        if query.get("filter[project]") != project_id:
+            return self.error(400, "Unknown project")
+        items = []
+        with state_lock:
+            for resource_id in resources:
+                resource = resources[resource_id]
+                if "filter[slug]" in query and query["filter[slug]"] != resource["slug"]:
+                    continue
+                items.append({"id": resource_id, "type": "resources", "attributes": {"name": resource["name"], "slug": resource["slug"], "string_count": resource["strings"]}})
+        page, next_url = paginate(self, items, query)
+        self.reply(200, {"data": page, "links": {"next": next_url}})
+
+    def list_strings(self, query):
+        resource_id = query.get("filter[resource]")
+        if resource_id not in strings:
+            return self.error(404, "Unknown resource")
+        fields = query["fields[resource_strings]"].split(",") if "fields[resource_strings]" in query else None
+        items = []
+        with state_lock:
+            for string in strings[resource_id]:
+                if "filter[key]" in query and string["key"] != query["filter[key]"]:
+                    continue
+                if "filter[date_modified][gte]" in query and string["modified"] < query["filter[date_modified][gte]"]:
+                    continue
+                items.append(string_data(resource_id, string, fields))
+        page, next_url = paginate(self, items, query)
+        self.reply(200, {"data": page, "links": {"next": next_url}})
+
+    def update_string(self, data):
+        with state_lock:
+            for resource_id in strings:
+                for string in strings[resource_id]:
+                    if string["id"] == data["id"]:
+                        attributes = data.get("attributes", {})
+                        if "tags" in attributes:
+                            string["tags"] = attributes["tags"]
+                        if "instructions" in attributes:
+                            string["instructions"] = attributes["instructions"]
+                        string["modified"] = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                        return string_data(resource_id, string, None)
+        return data
+
+    def create_job(self, job_type, payload):
+        relationships = payload["data"]["relationships"]
+        resource_id = relationships["resource"]["data"]["id"]
+        if resource_id not in resources:
+            return self.error(404, "Unknown resource")
+        code = "en"
+        if "language" in relationships:
+            code = languages.get(relationships["language"]["data"]["id"], "en")
+        job_id = hashlib.md5((job_type + str(time.time()) + str(random.random())).encode("utf-8")).hexdigest()
+        with state_lock:
+            jobs[job_id] = {"type": job_type, "resource": resource_id, "code": code, "created": time.time()}
+        self.reply(202, {"data": {"id": job_id, "type": job_type, "attributes": {"status": "pending", "errors": []}, "links": {"self": self.base_url() + "/" + job_type + "/" + job_id}}})
+
+    def job_status(self, job_id):
+        job = jobs.get(job_id)
+        if job == None:
+            return self.error(404, "Unknown job")
+        if time.time() - job["created"] < options.jobDuration:
+            return self.reply(200, {"data": {"id": job_id, "type": job["type"], "attributes": {"status": "pending", "errors": []}}})
+        if job["type"] == "resource_strings_async_uploads":
+            return self.reply(200, {"data": {"id": job_id, "type": job["type"], "attributes": {"status": "succeeded", "errors": [], "details": {"strings_created": 0, "strings_updated": 0, "strings_deleted": 0}}}})
+        self.reply(303, b"", {"Location": self.base_url() + "/_files/" + job_id})
+
+    def job_file(self, job_id):
+        job = jobs.get(job_id)
+        if job == None:
+            return self.error(404, "Unknown job")
+        content = make_file(job["resource"], job["code"])
+        if "Plurals" in resources[job["resource"]]["name"]:
+            self.reply(200, content.encode("utf-8"))
+        else:
+            self.reply(200, content.encode("utf-16"))
+
+    def gitlab_file(self, path):
+        # /api/v4/projects/<id>/repository/files/<url encoded path>/raw
+        file_path = unquote(path.split("/repository/files/", 1)[1].rsplit("/raw", 1)[0])
+        folder, file_name = file_path.split("/")[-2:]
+        code = folder.replace(".lproj", "")
+        if file_name.endswith(".stringsdict"):
+            name = "Plurals"
+        else:
+            name = file_name.split(".")[0]
+        resource_id = project_id + ":r:" + name.lower()
+        if resource_id not in resources:
+            return self.error(404, "File not found")
+        content = make_file(resource_id, "en" if code == "Base" else code)
+        self.reply(200, content.encode("utf-8"))
+
+def main():
+    global options, project_id
+    parser = argparse.ArgumentParser(description="Serves generated resources in place of the Transifex and Gitlab APIs")
+    parser.add_argument("--host", help="The address to listen on. Defaults to 127.0.0.1", default="127.0.0.1")
+    parser.add_argument("-p", "--port", help="The port to listen on. Defaults to 8765", type=int, default=8765)
+    parser.add_argument("--project", help="The Transifex project name. Defaults to ios-35", default="ios-35")
+    parser.add_argument("-r", "--resources", nargs="+", help="The resources to serve. Defaults to Localizable Plurals InfoPlist", default=["Localizable", "Plurals", "InfoPlist"])
+    parser.add_argument("-b", "--branch", help="Also serve a branch resource named <resource>-<branch> for each resource with a tenth of its strings")
+    parser.add_argument("-s", "--strings", help="The number of strings of each resource. Defaults to 1000", type=int, default=1000)
+    parser.add_argument("-l", "--languages", help="The number of languages of the project. Defaults to " + str(len(LANGUAGE_CODES)), type=int, default=len(LANGUAGE_CODES))
+    parser.add_argument("--pageSize", help="The number of items in each page of a list. Defaults to 150", type=int, default=150)
+    parser.add_argument("--latency", help="Milliseconds each request is delayed by. Defaults to 0", type=float, default=0)
+    parser.add_argument("--jitter", help="Up to this many random extra milliseconds of delay per request. Defaults to 0", type=float, default=0)
+    parser.add_argument("--jobDuration", help="Seconds an async upload or download job stays pending. Defaults to 1", type=float, default=1)
+    parser.add_argument("--rateLimit", help="The fraction of API requests answered with 429 Too Many Requests. Defaults to 0", type=float, default=0)
+    parser.add_argument("--retryAfter", help="The Retry-After seconds sent with a 429 response. Defaults to 1", type=float, default=1)
+    parser.add_argument("-v", "--verbose", help="Log every request", action="store_true")
+    options = parser.parse_args()
+
+    project_id = ORGANISATION + ":p:" + options.project
+    for code in LANGUAGE_CODES[0:options.languages]:
+        languages["l:" + code] = code
+    for name in options.resources:
+        add_resource(name, options.strings)
+        if options.branch:
+            add_resource(name + "-" + options.branch, max(1, options.strings // 10))
+
+    server = ThreadingHTTPServer((options.host, options.port), MockHandler)
+    print("Serving " + str(len(resources)) + " resources in " + str(len(languages)) + " languages on http://" + options.host + ":" + str(options.port))
+    print("Run the script with TRANSIFEX_BASE_URL=http://" + options.host + ":" + str(options.port) + " GITLAB_BASE_URL=http://" + options.host + ":" + str(options.port) + "/api/v4")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print_stats()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Checks the delays between the polls of async jobs for the Retry-After values a server can send
+
+import math, os, sys, unittest
+from unittest import mock
+
+TESTS_FOLDER = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_FOLDER))
+import iosTransifex as tx
+
+# Stands in for the time module of the script, sleeping only advances the clock
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class NextPollDelayTest(unittest.TestCase):
+    def check_backoff(self, retry_after):
+        delay = tx.next_poll_delay(1, retry_after)
+        self.assertTrue(math.isfinite(delay))
+        self.assertGreaterEqual(delay, min(tx.POLL_BACKOFF, tx.POLL_MAX_DELAY) * 0.8)
+        self.assertLessEqual(delay, min(tx.POLL_BACKOFF, tx.POLL_MAX_DELAY) * 1.2)
+
+    def test_valid_value(self):
+        self.assertEqual(tx.next_poll_delay(1, "3"), 3)
+
+    def test_nan_backs_off(self):
+        self.check_backoff("nan")
+
+    def test_infinite_backs_off(self):
+        self.check_backoff("inf")
+        self.check_backoff("-inf")
+
+    def test_http_date_backs_off(self):
+        self.check_backoff("Wed, 21 Oct 2015 07:28:00 GMT")
+
+    def test_negative_value(self):
+        self.assertEqual(tx.next_poll_delay(1, "-5"), 0)
+
+    def test_oversized_value(self):
+        self.assertEqual(tx.next_poll_delay(1, "3600"), tx.POLL_MAX_DELAY)
+        self.assertEqual(tx.next_poll_delay(1, "3600", tx.PRUNE_MAX_DELAY), tx.PRUNE_MAX_DELAY)
+
+class AwaitUploadTest(unittest.TestCase):
+    def await_pending_upload(self, retry_after):
+        clock = FakeClock()
+        def pending(url, json_payload = None, type = "GET", response_headers = None, *args):
+            clock.now += 0.1 # The request itself takes time
+            response_headers["retry-after"] = retry_after
+            return {"data": {"attributes": {"status": "pending"}}}
+        with mock.patch.object(tx, "time", clock), mock.patch.object(tx, "do_request", pending), mock.patch.object(tx, "first_poll_delay", lambda kind, size: 1):
+            self.assertFalse(tx.await_upload("http://localhost/upload"))
+        return clock
+
+    def test_invalid_values_time_out(self):
+        for retry_after in ["nan", "inf", "-1", "Wed, 21 Oct 2015 07:28:00 GMT"]:
+            clock = self.await_pending_upload(retry_after)
+            self.assertTrue(all(math.isfinite(seconds) and seconds >= 0 for seconds in clock.sleeps))
+            self.assertLessEqual(clock.now - 1000.0, tx.POLL_TIMEOUT + 0.1)
+
+    def test_sleep_stops_at_the_timeout(self):
+        clock = self.await_pending_upload("3600")
+        self.assertLessEqual(max(clock.sleeps), tx.POLL_MAX_DELAY)
+        self.assertLessEqual(clock.now - 1000.0, tx.POLL_TIMEOUT + 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Parses and rewrites the sample strings and stringsdict files in both directions and compares the output with the files written by the
+# revision before the strings processing was rewritten (52d8261). Run with: python3 -m unittest discover iosTransifex/tests
+
+import os, sys, unittest
+
+TESTS_FOLDER = os.path.dirname(os.path.realpath(__file__))
+FIXTURES_FOLDER = os.path.join(TESTS_FOLDER, "fixtures")
+sys.path.insert(0, os.path.dirname(TESTS_FOLDER))
+import iosTransifex as tx
+
+# Call this function to return the content of a fixture file
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_FOLDER, name), "r", encoding="utf-8", newline="") as file:
+        return file.read()
+
+class RoundTripTest(unittest.TestCase):
+    def setUp(self):
+        # Every file has to be parsed, not loaded from the parsed strings cache
+        self.map_cache_enabled = tx.map_cache_enabled
+        tx.map_cache_enabled = False
+
+    def tearDown(self):
+        tx.map_cache_enabled = self.map_cache_enabled
+
+    def check_round_trip(self, extension, is_plurals):
+        content = read_fixture("Sample." + extension)
+        self.assertEqual(tx.process_as_download(content, is_plurals), read_fixture(os.path.join("expected", "Sample.download." + extension)))
+        self.assertEqual(tx.process_as_upload(content, is_plurals), read_fixture(os.path.join("expected", "Sample.upload." + extension)))
+
+    def test_strings(self):
+        self.check_round_trip("strings", False)
+
+    def test_stringsdict(self):
+        self.check_round_trip("stringsdict", True)
+
+    def test_written_files_parse_to_the_same_strings(self):
+        for extension, is_plurals in [("strings", False), ("stringsdict", True)]:
+            map = tx.content_to_map(read_fixture("Sample." + extension), False, is_plurals)
+            written = tx.map_to_content(map, is_plurals)
+            self.assertEqual(tx.content_to_map(written, False, is_plurals), map)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,60 +1,55 @@
 #!/usr/bin/python3
 import glob
 import json
+import os
 import sys
 
-def getKeysInFile(filePath):
+RESOURCES_PATH = "./../Modules/Presentation/MEGAL10n/Sources/MEGAL10n/Resources/"
+BASE_DIRECTORY = RESOURCES_PATH + "Base.lproj"
+
+def readLines(filePath):
     try:
-        file = open(filePath, 'r')
+        with open(filePath, 'r') as file:
+            return file.readlines()
     except OSError:
         print("Error loading file: ", filePath)
         sys.exit(-1)
-    lines = file.readlines()
+
+def getKeysInFile(filePath):
     keys = []
-    for line in lines:
+    for line in readLines(filePath):
         line = line.strip()
         if "=" in line and not line.startswith("/*"):
             key, _ = line.split("=", 1)
             keys.append(key.replace('"', ''))
     return keys
 
-def checkIfKeyIsPresent(key, filePath):
-    try:
-        f = open(filePath, 'r')
-    except OSError:
-        print("Error loading file: ", filePath)
-        sys.exit(-1)
-    with open(filePath) as f:
-        lines = f.readlines()
-        for line in lines:
-            line = line.strip()
-            if "=" in line and not line.startswith("/*"):
-                line, _ = line.split("=", 1)
-                line = line.strip().replace('"', '')
-                if key == line:
-                    return True
-        return False  
+def getKeyIndex(filePath):
+    keys = set()
+    for line in readLines(filePath):
+        line = line.strip()
+        if "=" in line and not line.startswith("/*"):
+            key, _ = line.split("=", 1)
+            keys.add(key.strip().replace('"', ''))
+    return keys
 
 
 print("Loading base file")
-baseKeys = getKeysInFile("./../Modules/Presentation/MEGAL10n/Sources/MEGAL10n/Resources/Base.lproj/Localizable.strings")
+baseKeys = getKeysInFile(BASE_DIRECTORY + "/Localizable.strings")
 
-missingKeys = {}
-
-for baseKey in baseKeys:
-    print("scanning key: " + baseKey)
-    directories = glob.glob("./../Modules/Presentation/MEGAL10n/Sources/MEGAL10n/Resources/*.lproj")
-    directories.remove('./../Modules/Presentation/MEGAL10n/Sources/MEGAL10n/Resources/Base.lproj')
+directories = glob.glob(RESOURCES_PATH + "*.lproj")
+directories.remove(BASE_DIRECTORY)
 
-    missingFiles = []
-    for languageDir in directories:
-        localizedFilePath = languageDir + "/Localizable.strings"
-        if not checkIfKeyIsPresent(baseKey, localizedFilePath):
-            relativePath = localizedFilePath.split("/")[-2].split(".")[-2]
-            missingFiles.append(relativePath)
-    
-    if len(missingFiles) > 0:
-        missingKeys[baseKey] = missingFiles
+print("Loading " + str(len(directories)) + " language files")
+missingKeys = {}
+uniqueBaseKeys = set(baseKeys)
+for languageDir in directories:
+    localizedFilePath = languageDir + "/Localizable.strings"
+    missing = uniqueBaseKeys - getKeyIndex(localizedFilePath)
+    if missing:
+        language = os.path.basename(languageDir).split(".")[-2]
+        for key in missing:
+            missingKeys.setdefault(key, []).append(language)
 
 
 if len(missingKeys) > 0: